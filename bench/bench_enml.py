@@ -0,0 +1,70 @@
+#
+# Compare the cost of converting note content between ENML and text with the
+# fast path (enml.preToText) and with BeautifulSoup (enml.preToTextWithSoup),
+# for notes of 1 KB to 5 MB. Run with the same Python that Vim uses:
+#
+#     python bench/bench_enml.py
+#
+# Geeknote and BeautifulSoup must be installed. Vim is not needed.
+#
+import os
+import sys
+import time
+import types
+
+# enml.py reads its options from Vim. Outside of Vim, use the defaults.
+if 'vim' not in sys.modules:
+    vim = types.ModuleType('vim')
+    vim.eval = lambda expr: '0'
+    sys.modules['vim'] = vim
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'plugin'))
+
+import enml
+
+Sizes = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+
+Line = 'Some text with <tags>, & ampersands and "quotes" \xc3\xa9\xc3\xa8  \n'
+
+def makeText(size):
+    return (Line * (size / len(Line) + 1))[:size]
+
+# Return the shortest time (in milliseconds) it took to call func(arg).
+def measure(func, arg, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+def formatSize(size):
+    if size >= 1024 * 1024:
+        return '%d MB' % (size / (1024 * 1024))
+    return '%d KB' % (size / 1024)
+
+def main():
+    print '%-8s %14s %14s %14s %9s' % (
+        'size', 'textToENML', 'preToText', 'with soup', 'speedup')
+
+    for size in Sizes:
+        text    = makeText(size)
+        content = enml.textToENML(text)
+        repeat  = 5 if size < 1024 * 1024 else 2
+
+        fast = enml.preToText(content)
+        slow = enml.preToTextWithSoup(content)
+        if fast != slow:
+            print 'ERROR: the converters disagree on %s' % formatSize(size)
+            sys.exit(1)
+
+        encode = measure(enml.textToENML, text, repeat)
+        tFast  = measure(enml.preToText, content, repeat)
+        tSlow  = measure(enml.preToTextWithSoup, content, repeat)
+        print '%-8s %11.2f ms %11.2f ms %11.2f ms %8.1fx' % (
+            formatSize(size), encode, tFast, tSlow, tSlow / tFast)
+
+if __name__ == '__main__':
+    main()
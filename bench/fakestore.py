@@ -0,0 +1,302 @@
+#
+# An in-process stand-in for Evernote's note store, so that the plugin can be
+# benchmarked without an account (see run.py). It implements the calls that
+# the plugin makes, with the same arguments and results as the Thrift client
+# (the authentication token is ignored).
+#
+# The account is generated: 'notes' notes of about 'bodySize' bytes each,
+# spread over 'notebooks' notebooks and tagged with one of 'tags' tags. Every
+# call takes 'latency' seconds longer, as if made over the network. Calls may
+# be made from several threads at the same time.
+#
+import copy
+import time
+import hashlib
+import threading
+
+import evernote.edam.error.ttypes     as Errors
+import evernote.edam.notestore.ttypes as NoteStore
+import evernote.edam.type.ttypes      as Types
+
+# The most notes that findNotesMetadata returns at once, like the server.
+MaxNotesPerPage = 250
+
+ContentHeader = '<?xml version="1.0" encoding="UTF-8"?>' \
+                '<!DOCTYPE en-note SYSTEM ' \
+                '"http://xml.evernote.com/pub/enml2.dtd">' \
+                '<en-note><pre>'
+ContentFooter = '</pre></en-note>'
+
+Line = 'The quick brown fox jumps over the lazy dog & <friends>. \xc3\xa9\n'
+
+def makeBody(size):
+    body = Line * (size / len(Line) + 1)
+    body = body[:size].replace('&', '&amp;')
+    return body.replace('<', '&lt;').replace('>', '&gt;')
+
+class FakeNoteStore(object):
+    def __init__(self, notes, bodySize, notebooks=10, tags=5, latency=0.0):
+        self.latency   = latency
+        self.lock      = threading.Lock()
+        self.usn       = 0
+        self.calls     = {}
+        self.notebooks = {}
+        self.tags      = {}
+        self.notes     = {}
+        self.contents  = {}
+        self.hashes    = {}
+        self.listings  = {}
+
+        # Notes share their body, generated once, to keep memory in check.
+        self.body = makeBody(bodySize)
+
+        for i in xrange(notebooks):
+            notebook = Types.Notebook()
+            notebook.guid              = 'notebook-%d' % i
+            notebook.name              = 'Notebook %d' % i
+            notebook.defaultNotebook   = i == 0
+            notebook.updateSequenceNum = self.nextUsn()
+            self.notebooks[notebook.guid] = notebook
+
+        for i in xrange(tags):
+            tag = Types.Tag()
+            tag.guid              = 'tag-%d' % i
+            tag.name              = 'Tag %d' % i
+            tag.updateSequenceNum = self.nextUsn()
+            self.tags[tag.guid] = tag
+
+        for i in xrange(notes):
+            note = Types.Note()
+            note.guid              = 'note-%d' % i
+            note.title             = 'Note %d' % i
+            note.notebookGuid      = 'notebook-%d' % (i % max(notebooks, 1))
+            note.tagGuids          = ['tag-%d' % (i % tags)] if tags else None
+            note.created           = 1000000 + i
+            note.updated           = 1000000 + i
+            note.active            = True
+            note.updateSequenceNum = self.nextUsn()
+            self.notes[note.guid] = note
+
+    def nextUsn(self):
+        self.usn += 1
+        return self.usn
+
+    # Count the call and wait as long as a request would take.
+    def call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def getContent(self, note):
+        content = self.contents.get(note.guid)
+        if content is None:
+            content = ''.join((ContentHeader, note.title, '\n', self.body,
+                               ContentFooter))
+        return content
+
+    def getNoteResult(self, note, withContent):
+        content = self.getContent(note)
+
+        contentHash = self.hashes.get(note.guid)
+        if contentHash is None:
+            contentHash = hashlib.md5(content).digest()
+            self.hashes[note.guid] = contentHash
+
+        result = copy.copy(note)
+        result.contentHash   = contentHash
+        result.contentLength = len(content)
+        result.content       = content if withContent else None
+        return result
+
+    def setContent(self, note, content):
+        self.contents[note.guid] = content
+        self.hashes.pop(note.guid, None)
+
+    def getNotFound(self, key, guid):
+        return Errors.EDAMNotFoundException(identifier=key, key=guid)
+
+    #
+    # Return the notes that match the filter, most recently updated first.
+    # Listings are kept until a note changes so that listing the same notes
+    # page by page does not sort them again for every page.
+    #
+    def getListing(self, filter):
+        key = (filter.notebookGuid, tuple(filter.tagGuids or []),
+               filter.words)
+
+        listing = self.listings.get(key)
+        if listing is None:
+            listing = [note for note in self.notes.values()
+                       if self.matches(filter, note)]
+            listing.sort(key=lambda note: note.updated, reverse=True)
+            self.listings[key] = listing
+        return listing
+
+    def matches(self, filter, note):
+        if filter.notebookGuid and note.notebookGuid != filter.notebookGuid:
+            return False
+        if filter.tagGuids:
+            if not set(filter.tagGuids) <= set(note.tagGuids or []):
+                return False
+        if filter.words:
+            return filter.words.lower() in note.title.lower()
+        return True
+
+    def changed(self, note):
+        note.updateSequenceNum = self.nextUsn()
+        note.updated           = int(time.time() * 1000)
+        self.listings.clear()
+
+    #======================== Note Store Calls ===============================#
+
+    def createNote(self, token, note):
+        self.call('createNote')
+        with self.lock:
+            content = note.content or ContentHeader + ContentFooter
+
+            note = copy.copy(note)
+            note.guid    = 'note-new-%d' % self.usn
+            note.active  = True
+            note.content = None
+            self.notes[note.guid] = note
+            self.setContent(note, content)
+            self.changed(note)
+            return self.getNoteResult(note, False)
+
+    def createNotebook(self, token, notebook):
+        self.call('createNotebook')
+        with self.lock:
+            notebook = copy.copy(notebook)
+            notebook.guid              = 'notebook-new-%d' % self.usn
+            notebook.updateSequenceNum = self.nextUsn()
+            self.notebooks[notebook.guid] = notebook
+            return copy.copy(notebook)
+
+    def findNoteCounts(self, token, filter, withTrash):
+        self.call('findNoteCounts')
+        with self.lock:
+            counts = NoteStore.NoteCollectionCounts()
+            counts.notebookCounts = {}
+            counts.tagCounts      = {}
+            for note in self.notes.values():
+                guid = note.notebookGuid
+                counts.notebookCounts[guid] = \
+                    counts.notebookCounts.get(guid, 0) + 1
+                for guid in note.tagGuids or []:
+                    counts.tagCounts[guid] = counts.tagCounts.get(guid, 0) + 1
+            return counts
+
+    def findNotesMetadata(self, token, filter, offset, maxNotes, spec):
+        self.call('findNotesMetadata')
+        with self.lock:
+            listing = self.getListing(filter)
+            count   = min(maxNotes, MaxNotesPerPage)
+
+            result = NoteStore.NotesMetadataList()
+            result.startIndex = offset
+            result.totalNotes = len(listing)
+            result.notes      = []
+            for note in listing[offset:offset + count]:
+                meta = NoteStore.NoteMetadata()
+                meta.guid              = note.guid
+                meta.title             = note.title
+                meta.updated           = note.updated
+                meta.updateSequenceNum = note.updateSequenceNum
+                meta.notebookGuid      = note.notebookGuid
+                meta.tagGuids          = note.tagGuids
+                result.notes.append(meta)
+            return result
+
+    def getDefaultNotebook(self, token):
+        self.call('getDefaultNotebook')
+        for notebook in self.notebooks.values():
+            if notebook.defaultNotebook:
+                return copy.copy(notebook)
+
+    def getFilteredSyncChunk(self, token, afterUSN, maxEntries, filter):
+        self.call('getFilteredSyncChunk')
+        with self.lock:
+            objects = self.notes.values() + self.notebooks.values() + \
+                      self.tags.values()
+            objects = [o for o in objects if o.updateSequenceNum > afterUSN]
+            objects.sort(key=lambda o: o.updateSequenceNum)
+            objects = objects[:maxEntries]
+
+            chunk = NoteStore.SyncChunk()
+            chunk.currentTime = int(time.time() * 1000)
+            chunk.updateCount = self.usn
+            chunk.notes       = []
+            chunk.notebooks   = []
+            chunk.tags        = []
+            if objects:
+                chunk.chunkHighUSN = objects[-1].updateSequenceNum
+
+            for obj in objects:
+                if isinstance(obj, Types.Note):
+                    chunk.notes.append(self.getNoteResult(obj, False))
+                elif isinstance(obj, Types.Notebook):
+                    chunk.notebooks.append(copy.copy(obj))
+                else:
+                    chunk.tags.append(copy.copy(obj))
+            return chunk
+
+    def getNote(self, token, guid, withContent, withResourcesData,
+                withResourcesRecognition, withResourcesAlternateData):
+        self.call('getNote')
+        with self.lock:
+            note = self.notes.get(guid)
+            if note is None:
+                raise self.getNotFound('Note.guid', guid)
+            return self.getNoteResult(note, withContent)
+
+    def getNotebook(self, token, guid):
+        self.call('getNotebook')
+        notebook = self.notebooks.get(guid)
+        if notebook is None:
+            raise self.getNotFound('Notebook.guid', guid)
+        return copy.copy(notebook)
+
+    def getSyncState(self, token):
+        self.call('getSyncState')
+        state = NoteStore.SyncState()
+        state.currentTime    = int(time.time() * 1000)
+        state.fullSyncBefore = 0
+        state.updateCount    = self.usn
+        return state
+
+    def listNotebooks(self, token):
+        self.call('listNotebooks')
+        return [copy.copy(n) for n in self.notebooks.values()]
+
+    def listTags(self, token):
+        self.call('listTags')
+        return [copy.copy(t) for t in self.tags.values()]
+
+    def updateNote(self, token, note):
+        self.call('updateNote')
+        with self.lock:
+            stored = self.notes.get(note.guid)
+            if stored is None:
+                raise self.getNotFound('Note.guid', note.guid)
+
+            stored.title = note.title
+            if note.notebookGuid is not None:
+                stored.notebookGuid = note.notebookGuid
+            if note.tagGuids is not None:
+                stored.tagGuids = note.tagGuids
+            if note.content is not None:
+                self.setContent(stored, note.content)
+            self.changed(stored)
+            return self.getNoteResult(stored, False)
+
+    def updateNotebook(self, token, notebook):
+        self.call('updateNotebook')
+        with self.lock:
+            stored = self.notebooks.get(notebook.guid)
+            if stored is None:
+                raise self.getNotFound('Notebook.guid', notebook.guid)
+
+            stored.name              = notebook.name
+            stored.updateSequenceNum = self.nextUsn()
+            return stored.updateSequenceNum
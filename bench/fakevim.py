@@ -0,0 +1,276 @@
+#
+# A stand-in for Vim's 'vim' Python module, so that the plugin can be run
+# outside of Vim (see run.py). Buffers and windows are kept in memory and only
+# the expressions and commands that the plugin uses are understood. Anything
+# else is ignored.
+#
+# Vim options are set through the 'variables' dictionary (e.g.
+# variables['GeeknoteFormat'] for g:GeeknoteFormat). Timers are not
+# supported, so the plugin makes its requests in the foreground.
+#
+import re
+
+#======================== Buffers and Windows ================================#
+
+class Options(dict):
+    Defaults = {'modified': False, 'buftype': '', 'previewwindow': False}
+
+    def __getitem__(self, key):
+        return self.get(key, self.Defaults.get(key, ''))
+
+class Buffer(object):
+    def __init__(self, number, name=''):
+        self.number  = number
+        self.name    = name
+        self.lines   = ['']
+        self.options = Options()
+        self.vars    = {}
+        self.valid   = True
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.lines[index] = list(value)
+        else:
+            self.lines[index] = value
+        self.changed()
+
+    def __delitem__(self, index):
+        del self.lines[index]
+        self.changed()
+
+    def append(self, lines, index=None):
+        if isinstance(lines, basestring):
+            lines = [lines]
+        if index is None:
+            index = len(self.lines)
+        self.lines[index:index] = list(lines)
+        self.changed()
+
+    # A buffer always has at least one (empty) line, like in Vim.
+    def changed(self):
+        if not self.lines:
+            self.lines = ['']
+        self.options['modified'] = True
+
+class Window(object):
+    def __init__(self, buffer):
+        self.buffer  = buffer
+        self.cursor  = (1, 0)
+        self.options = Options()
+        self.width   = 80
+        self.height  = 50
+
+class BufferList(object):
+    def __init__(self):
+        self.buffers = {}
+        self.last    = 0
+
+    def __getitem__(self, number):
+        return self.buffers[number]
+
+    def __iter__(self):
+        return iter(self.buffers.values())
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def create(self, name=''):
+        self.last += 1
+        buffer = Buffer(self.last, name)
+        self.buffers[buffer.number] = buffer
+        return buffer
+
+    def find(self, name):
+        for buffer in self.buffers.values():
+            if buffer.name == name or str(buffer.number) == name:
+                return buffer
+        return None
+
+class Current(object):
+    def __init__(self):
+        self.window = None
+
+    @property
+    def buffer(self):
+        return self.window.buffer
+
+    @property
+    def line(self):
+        return self.buffer[self.window.cursor[0] - 1]
+
+buffers = BufferList()
+windows = []
+current = Current()
+
+# Global variables (g:) and the local variables of the current function (l:).
+variables      = {}
+localVariables = {}
+
+class error(Exception):
+    pass
+
+def reset():
+    buffers.buffers.clear()
+    del windows[:]
+    variables.clear()
+    localVariables.clear()
+
+    current.window = Window(buffers.create())
+    windows.append(current.window)
+
+reset()
+
+#======================== Expressions ========================================#
+
+OptionValues = {'numberwidth': '4', 'foldcolumn': '0', 'hidden': '0'}
+
+def getWindowNumber(arg=None):
+    if arg == '$':
+        return len(windows)
+    if arg == '#':
+        return max(1, windows.index(current.window))
+    return windows.index(current.window) + 1
+
+def toString(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    return value
+
+def eval(expr):
+    expr = expr.strip()
+
+    m = re.match(r'exists\("g:(\w+)"\)$', expr)
+    if m:
+        return '1' if m.group(1) in variables else '0'
+
+    m = re.match(r'g:(\w+)$', expr)
+    if m:
+        return toString(variables[m.group(1)])
+
+    m = re.match(r'l:(\w+)$', expr)
+    if m:
+        return toString(localVariables[m.group(1)])
+
+    m = re.match(r'has\("(\w+)"\)$', expr)
+    if m:
+        return '0'
+
+    m = re.match(r'&(\w+)$', expr)
+    if m:
+        return OptionValues.get(m.group(1), '0')
+
+    m = re.match(r'line\("w([0$])"\)$', expr)
+    if m:
+        if m.group(1) == '0':
+            return '1'
+        return str(min(len(current.buffer), current.window.height))
+
+    raise error('unsupported expression: ' + expr)
+
+#======================== Commands ===========================================#
+
+def command(cmd):
+    cmd = cmd.strip()
+
+    m = re.match(r"let l:num = winnr\('?([^')]*)'?\)$", cmd)
+    if m:
+        localVariables['num'] = getWindowNumber(m.group(1) or None)
+        return
+
+    m = re.match(r"let l:num = winbufnr\('(\d+)'\)$", cmd)
+    if m:
+        number = int(m.group(1))
+        if 0 < number <= len(windows):
+            localVariables['num'] = windows[number - 1].buffer.number
+        else:
+            localVariables['num'] = -1
+        return
+
+    m = re.match(r'exec (\d+) \. "wincmd w"$', cmd)
+    if m:
+        number = int(m.group(1))
+        if 0 < number <= len(windows):
+            current.window = windows[number - 1]
+        return
+
+    m = re.match(r'(topleft \d+ )?(vnew|vertical new|new)$', cmd)
+    if m:
+        openWindow(buffers.create(), m.group(1) is not None)
+        return
+
+    m = re.match(r'topleft vertical \d+ sbuffer (\d+)$', cmd)
+    if m:
+        openWindow(buffers[int(m.group(1))], True)
+        return
+
+    m = re.match(r'(?:silent )?(?:edit|buffer) (.*)$', cmd)
+    if m:
+        buffer = buffers.find(m.group(1))
+        if buffer is None:
+            buffer = buffers.create(m.group(1))
+        current.window.buffer = buffer
+        return
+
+    m = re.match(r'(?:silent )?file (.*)$', cmd)
+    if m:
+        current.buffer.name = m.group(1)
+        return
+
+    m = re.match(r'bwipeout! (\d+)$', cmd)
+    if m:
+        wipeBuffer(buffers[int(m.group(1))])
+        return
+
+    if cmd == 'close!':
+        windows.remove(current.window)
+        current.window = windows[0]
+        return
+
+    if cmd == 'enew':
+        current.window.buffer = buffers.create()
+        return
+
+    m = re.match(r'let b:(\w+)\s*=\s*"(.*)"$', cmd)
+    if m:
+        current.buffer.vars[m.group(1)] = m.group(2)
+        return
+
+    m = re.match(r'setlocal (\w+)=?(\S*)$', cmd)
+    if m:
+        current.buffer.options[m.group(1)] = m.group(2) or True
+        return
+
+    m = re.match(r'echoerr (.*)$', cmd)
+    if m:
+        raise error(m.group(1))
+
+def openWindow(buffer, topLeft):
+    window = Window(buffer)
+    if topLeft:
+        windows.insert(0, window)
+    else:
+        windows.insert(windows.index(current.window) + 1, window)
+    current.window = window
+
+def wipeBuffer(buffer):
+    for window in list(windows):
+        if window.buffer is buffer:
+            if len(windows) > 1:
+                windows.remove(window)
+            else:
+                window.buffer = buffers.create()
+    current.window = windows[0]
+
+    buffer.valid = False
+    del buffers.buffers[buffer.number]
@@ -0,0 +1,272 @@
+#
+# Time the plugin's main paths against a fake note store (see fakestore.py)
+# instead of an Evernote account, with Vim replaced by fakevim.py:
+#
+#   refresh  - load the navigation window from the server (nothing stored)
+#   render   - show the navigation window
+#   expand   - download the notes of every notebook and render them
+#   commit   - rename 10 notes in the navigation window and save them
+#   sync     - synchronize the account incrementally
+#   open     - open a note (downloading and converting its content)
+#   reopen   - open the same note again (from the caches)
+#   save     - change the note and save it (uploading its content)
+#
+# Each combination of account size and note size is run in a fresh process,
+# with an empty metadata store, and the best time of each step over several
+# runs is reported. Run with the same Python that Vim uses, e.g.
+#
+#     python bench/run.py --notes 10,1000,100000 --body 1KB,1MB --latency 50
+#
+# Use --save to keep the results and --compare to show how a later run
+# differs from them. Geeknote must be installed (for its ENML conversions),
+# Vim is not needed.
+#
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import collections
+
+BenchDirectory  = os.path.dirname(os.path.abspath(__file__))
+PluginDirectory = os.path.join(BenchDirectory, '..', 'plugin')
+
+Steps = ['refresh', 'render', 'expand', 'commit', 'sync', 'open', 'reopen',
+         'save']
+
+#======================== Benchmarked Steps ==================================#
+
+#
+# Run every step once (in the child process) and return how long each took,
+# in seconds.
+#
+def runSteps(config):
+    sys.path.insert(0, BenchDirectory)
+    sys.path.insert(1, PluginDirectory)
+
+    import fakevim
+    import fakestore
+    sys.modules['vim'] = fakevim
+
+    scratch = tempfile.mkdtemp()
+    fakevim.variables['GeeknoteScratchDirectory'] = scratch
+    fakevim.variables['GeeknoteRequestRate']      = config['rate']
+
+    store = fakestore.FakeNoteStore(
+        config['notes'], config['body'], config['notebooks'],
+        latency=config['latency'] / 1000.0)
+
+    # Connect to the fake note store instead of logging in.
+    import conn
+    conn.geeknote  = store
+    conn.authToken = 'bench'
+    conn.noteStorePool.createClient = lambda: store
+
+    import explorer as explorerModule
+    import vim_geeknote
+    import view
+
+    #
+    # Load what the plugin loads when first needed, so that it does not count
+    # towards the step that happens to need it first.
+    #
+    import enml
+    enml.getEditor()
+    from geeknote.out import tools
+
+    times = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def step(name):
+        start = time.time()
+        yield
+        times[name] = time.time() - start
+
+    try:
+        with step('refresh'):
+            explorer = vim_geeknote.getExplorer()
+
+        with step('render'):
+            explorer.show()
+
+        with step('expand'):
+            explorer.prefetch(explorer.notebooks)
+            for node in explorer.notebooks:
+                node.expand()
+            explorer.render()
+
+        noteRows = sorted(row for row, node in explorerModule.rowMap.items()
+                          if isinstance(node, explorerModule.NoteNode))
+        if not noteRows:
+            raise RuntimeError('no notes were rendered')
+
+        with step('commit'):
+            lines = explorer.buffer[:]
+            for row in noteRows[:10]:
+                lines[row - 1] = lines[row - 1].replace('Note', 'Renamed', 1)
+            explorer.buffer[:] = lines
+            vim_geeknote.GeeknoteCommitChanges()
+
+        with step('sync'):
+            explorer.sync()
+            explorer.render()
+
+        # Open the note in the first row, as if <cr> was pressed on it.
+        explorerWindow = getWindow(fakevim, explorer.buffer)
+        fakevim.current.window = explorerWindow
+        explorerWindow.cursor  = (noteRows[0], 0)
+
+        with step('open'):
+            vim_geeknote.GeeknoteActivateNode()
+        buffer = getNoteBuffer(fakevim)
+
+        # Close the note, as if its buffer was wiped.
+        fakevim.command('bwipeout! {}'.format(buffer.number))
+        view.GeeknoteCloseNote(buffer.name)
+        fakevim.current.window = explorerWindow
+
+        with step('reopen'):
+            vim_geeknote.GeeknoteActivateNode()
+        buffer = getNoteBuffer(fakevim)
+
+        with step('save'):
+            buffer.append('One more line.')
+            vim_geeknote.GeeknoteSaveNote(buffer.name)
+
+        if not store.calls.get('updateNote'):
+            raise RuntimeError('nothing was uploaded')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return times
+
+def getWindow(fakevim, buffer):
+    for window in fakevim.windows:
+        if window.buffer is buffer:
+            return window
+    raise RuntimeError('buffer {} is not shown'.format(buffer.name))
+
+def getNoteBuffer(fakevim):
+    for buffer in fakevim.buffers:
+        if buffer.name.startswith('geeknote://') and len(buffer) > 2:
+            return buffer
+    raise RuntimeError('the note was not opened')
+
+#======================== Running ============================================#
+
+# Run the steps in a new process, so that every run starts from scratch.
+def runChild(config):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child',
+         json.dumps(config)])
+    return json.loads(output.splitlines()[-1])
+
+def runConfig(config, repeat):
+    best = {}
+    for i in range(repeat):
+        for name, seconds in runChild(config).items():
+            if name not in best or seconds < best[name]:
+                best[name] = seconds
+    return best
+
+def getConfigKey(config):
+    return '%d notes, %s' % (config['notes'], formatSize(config['body']))
+
+def parseSize(text):
+    text = text.strip().upper()
+    for suffix, factor in [('MB', 1024 * 1024), ('KB', 1024), ('B', 1)]:
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+def formatSize(size):
+    if size >= 1024 * 1024:
+        return '%d MB' % (size / (1024 * 1024))
+    if size >= 1024:
+        return '%d KB' % (size / 1024)
+    return '%d B' % size
+
+def printHeader():
+    print '%-22s' % 'notes, body' + ''.join('%9s' % s for s in Steps)
+
+def printResults(key, results, previous):
+    cells = []
+    for name in Steps:
+        cells.append('%9.1f' % (results.get(name, 0) * 1000))
+    print '%-22s' % key + ''.join(cells)
+
+    if previous is None:
+        return
+
+    # How much slower (+) or faster (-) each step got, in percent.
+    cells = []
+    for name in Steps:
+        before = previous.get(name)
+        if before:
+            change = (results.get(name, 0) - before) / before * 100
+            cells.append('%8.0f%%' % change)
+        else:
+            cells.append('%9s' % '-')
+    print '%-22s' % '' + ''.join(cells)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark vim-geeknote against a fake note store.')
+    parser.add_argument('--notes', default='10,1000,10000',
+                        help='numbers of notes in the account')
+    parser.add_argument('--body', default='1KB,100KB',
+                        help='sizes of the notes (e.g. 1KB,10MB)')
+    parser.add_argument('--notebooks', type=int, default=10,
+                        help='number of notebooks in the account')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds each request takes')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='g:GeeknoteRequestRate (0 does not limit)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each combination (the best counts)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with the ones in FILE')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print json.dumps(runSteps(json.loads(args.child)))
+        return
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print 'Times in ms, best of %d runs, %.0f ms latency per request' % (
+        args.repeat, args.latency)
+    printHeader()
+
+    saved = collections.OrderedDict()
+    for notes in [int(n) for n in args.notes.split(',')]:
+        for body in [parseSize(s) for s in args.body.split(',')]:
+            config = {
+                'notes'     : notes,
+                'body'      : body,
+                'notebooks' : args.notebooks,
+                'latency'   : args.latency,
+                'rate'      : args.rate,
+            }
+
+            key     = getConfigKey(config)
+            results = runConfig(config, max(args.repeat, 1))
+            saved[key] = results
+            printResults(key, results, previous.get(key))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(saved, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import copy
+import threading
+import collections
+
+#======================== MemoryCache ========================================#
+
+# Keeps the most recently used 'size' values in memory.
+class MemoryCache(object):
+    def __init__(self, size):
+        self.size   = max(size, 0)
+        self.values = collections.OrderedDict()
+        self.lock   = threading.Lock()
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.pop(key, None)
+            if value is not None:
+                self.values[key] = value
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = value
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+#======================== ContentCache =======================================#
+
+#
+# Keeps the content of recently opened notes so that re-opening a note does
+# not download its content again. Notes are kept in memory (the most recently
+# used 'memoryEntries' of them) and, if a metadata store is given, on disk (up
+# to 'diskBytes' of content).
+#
+# Each note is kept along with its update sequence number and content hash.
+# A note whose update sequence number has not changed can be served as is. If
+# only its metadata changed, its content hash tells whether the cached content
+# is still current (see GeeknoteLoadNote in conn.py).
+#
+class ContentCache(object):
+    def __init__(self, store, memoryEntries, diskBytes):
+        self.store     = store
+        self.diskBytes = max(diskBytes, 0)
+        self.notes     = MemoryCache(memoryEntries)
+
+    def delete(self, guids):
+        for guid in guids:
+            self.notes.delete(guid)
+
+        if self.store is not None:
+            self.store.deleteNoteContent(guids)
+
+    #
+    # Return a copy of the cached note (None if not cached). Callers may
+    # modify the copy without affecting the cache.
+    #
+    def get(self, guid):
+        note = self.notes.get(guid)
+        if note is None and self.store is not None:
+            note = self.store.getNoteContent(guid)
+            if note is not None:
+                self.notes.put(guid, note)
+
+        if note is None:
+            return None
+        return copy.copy(note)
+
+    # Cache a note that was loaded (or saved) along with its content.
+    def put(self, note):
+        if note.guid is None or note.content is None:
+            return
+
+        note = copy.copy(note)
+        self.notes.put(note.guid, note)
+
+        if self.store is not None:
+            self.store.putNoteContent(note)
+            self.store.trimNoteContent(self.diskBytes)
+
+#======================== TextCache ==========================================#
+
+#
+# Keeps the text that note content was converted to for display (see
+# ENMLtoText in enml.py), keyed by the content's hash and the format it was
+# converted to. Content that did not change is never converted twice. Like
+# ContentCache, text is kept in memory and, if a store is given, on disk.
+#
+class TextCache(object):
+    def __init__(self, store, memoryEntries, diskBytes):
+        self.store     = store
+        self.diskBytes = max(diskBytes, 0)
+        self.texts     = MemoryCache(memoryEntries)
+
+    def get(self, contentHash, format):
+        key  = (contentHash, format)
+        text = self.texts.get(key)
+        if text is None and self.store is not None:
+            text = self.store.getConvertedText(contentHash, format)
+            if text is not None:
+                self.texts.put(key, text)
+        return text
+
+    def put(self, contentHash, format, text):
+        self.texts.put((contentHash, format), text)
+
+        if self.store is not None:
+            self.store.putConvertedText(contentHash, format, text)
+            self.store.trimConvertedText(self.diskBytes)
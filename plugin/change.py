@@ -1,9 +1,34 @@
+import collections
+
 from conn import *
 
 #======================== Change =============================================#
 
 class Change(object):
     def apply(self):
+        self.applyTo(self.getObject())
+        self.upload(self.getObject())
+
+    # Make the change to the given copy of the changed object.
+    def applyTo(self, obj):
+        pass
+
+    def describe(self):
+        return ''
+
+    def getGuid(self):
+        return self.getObject().guid
+
+    # Return the note/notebook that was changed.
+    def getObject(self):
+        return None
+
+    # Queue the changed object to be uploaded later (see SaveQueue).
+    def journal(self, queue, obj):
+        pass
+
+    # Send the changed object to the server (may run on a worker thread).
+    def upload(self, obj):
         pass
 
 #======================== NoteRenamed ========================================#
@@ -13,9 +38,20 @@ class NoteRenamed(Change):
         self.note = note
         self.newTitle = newTitle
 
-    def apply(self):
-        self.note.title = self.newTitle
-        GeeknoteUpdateNote(self.note)
+    def applyTo(self, note):
+        note.title = self.newTitle
+
+    def describe(self):
+        return 'note "{}"'.format(self.newTitle)
+
+    def getObject(self):
+        return self.note
+
+    def journal(self, queue, note):
+        queue.add(note, False)
+
+    def upload(self, note):
+        GeeknoteUpdateNoteMeta(note)
 
 #======================== NoteMoved ==========================================#
 
@@ -24,9 +60,20 @@ class NoteMoved(Change):
         self.note = note
         self.newNotebookGuid = newNotebookGuid
 
-    def apply(self):
-        self.note.notebookGuid = self.newNotebookGuid
-        GeeknoteUpdateNote(self.note)
+    def applyTo(self, note):
+        note.notebookGuid = self.newNotebookGuid
+
+    def describe(self):
+        return 'note "{}"'.format(self.note.title)
+
+    def getObject(self):
+        return self.note
+
+    def journal(self, queue, note):
+        queue.add(note, False)
+
+    def upload(self, note):
+        GeeknoteUpdateNoteMeta(note)
 
 #======================== NotebookRenamed ====================================#
 
@@ -35,7 +82,96 @@ class NotebookRenamed(Change):
         self.notebook = notebook
         self.newName = newName
 
-    def apply(self):
-        self.notebook.name = self.newName
-        GeeknoteUpdateNotebook(self.notebook)
+    def applyTo(self, notebook):
+        notebook.name = self.newName
+
+    def describe(self):
+        return 'notebook "{}"'.format(self.newName)
+
+    def getObject(self):
+        return self.notebook
+
+    def journal(self, queue, notebook):
+        queue.addNotebook(notebook)
+
+    def upload(self, notebook):
+        GeeknoteUpdateNotebook(notebook)
+
+#======================== ChangeBatch ========================================#
+
+#
+# Collects changes and sends them to the server together. All changes made to
+# the same note/notebook are merged into a single update (a note that was
+# renamed and moved is only sent once) and the updates of different objects
+# are sent at the same time.
+#
+class ChangeBatch(object):
+    def __init__(self):
+        self.changes = collections.OrderedDict()
+
+    def add(self, change):
+        self.changes.setdefault(change.getGuid(), []).append(change)
+
+    #
+    # Send all changes using the workers of the given pool and wait for them
+    # to be saved. A failed update does not affect the others. Returns a list
+    # of (changes, exception) tuples for the updates that failed.
+    #
+    # Objects that are still queued in the given SaveQueue (e.g. a note whose
+    # content is being uploaded) are queued again instead. The queued upload
+    # would otherwise undo the changes once it is made.
+    #
+    def commit(self, pool, queue=None):
+        updates = []
+        for changes, obj in self.merge():
+            if queue is not None and queue.isQueued(obj.guid):
+                changes[0].journal(queue, obj)
+                continue
+
+            future = pool.submit(changes[0].upload, obj)
+            updates.append((changes, future))
+
+        failures = []
+        for changes, future in updates:
+            try:
+                future.wait()
+            except Exception as e:
+                failures.append((changes, e))
+        return failures
+
+    #
+    # Queue the updates in the given SaveQueue instead of sending them (e.g.
+    # while offline).
+    #
+    def journal(self, queue):
+        for changes, obj in self.merge():
+            changes[0].journal(queue, obj)
+
+    def isEmpty(self):
+        return len(self.changes) == 0
+
+    #
+    # Return the changes made to each object along with the object to send,
+    # and forget about them.
+    #
+    def merge(self):
+        merged = []
+        for guid, changes in self.changes.items():
+            #
+            # Changes may have been made to different nodes (and so to
+            # different copies) of the same object. Make all of them to every
+            # copy and send the first.
+            #
+            copies = []
+            for change in changes:
+                obj = change.getObject()
+                if not any(obj is c for c in copies):
+                    copies.append(obj)
+
+            for obj in copies:
+                for change in changes:
+                    change.applyTo(obj)
 
+            merged.append((changes, copies[0]))
+        self.changes.clear()
+        return merged
@@ -1,71 +1,796 @@
-import evernote.edam.limits.constants as Limits
+import vim
+import os
+import re
+import socket
+import hashlib
+import threading
 
-from geeknote.geeknote import *
+import evernote.edam.error.ttypes         as Errors
+import evernote.edam.limits.constants     as Limits
+import evernote.edam.notestore.ttypes     as NoteStore
+import evernote.edam.type.ttypes          as Types
 
-# Connection to Geeknote
-geeknote  = GeekNote()
-authToken = geeknote.authToken
-noteStore = geeknote.getNoteStore()
+from thrift.transport.TTransport import TTransportException
+
+from cache import ContentCache, TextCache
+from scheduler import *
+from store import MetadataStore
+from utils import *
+
+import stats
+
+#======================== Connection =========================================#
+
+#
+# Geeknote is not loaded, and the server is not contacted, until the first
+# request is made (see connect()). Loading the plugin only reads what is
+# stored locally.
+#
+geeknote    = None
+authToken   = None
+connectLock = threading.Lock()
+
+#
+# Connect to Geeknote (once) and return the authentication token. Without a
+# connection (e.g. on a plane) switch to offline mode instead (see
+# GeeknoteSetOffline()). Any other error (e.g. not being logged in) is raised
+# as is. May be called from any thread.
+#
+def connect():
+    global geeknote, authToken
+
+    with connectLock:
+        if geeknote is None:
+            try:
+                with startupPhase('connect'):
+                    from geeknote.geeknote import GeekNote
+                    connection = GeekNote()
+            except (socket.error, TTransportException):
+                GeeknoteSetOffline(True)
+                raise OfflineError()
+
+            authToken = connection.authToken
+            geeknote  = connection
+            checkMetadataStoreOwner()
+    return authToken
+
+#
+# Connect again after the server rejected the given token as expired. Geeknote
+# reads the token anew (e.g. after logging in again with geeknote). Requests
+# being made meanwhile keep their clients, the next ones get new clients.
+#
+def reconnect(expiredToken):
+    global geeknote, authToken
+
+    with connectLock:
+        if authToken == expiredToken:
+            geeknote  = None
+            authToken = None
+            noteStorePool.reset()
+    return connect()
+
+def isAuthExpired(e):
+    return isinstance(e, Errors.EDAMUserException) and \
+           e.errorCode == Errors.EDAMErrorCode.AUTH_EXPIRED
+
+def isRateLimited(e):
+    return isinstance(e, Errors.EDAMSystemException) and \
+           e.errorCode == Errors.EDAMErrorCode.RATE_LIMIT_REACHED
+
+#
+# Did the server answer the request (even if with an error)? If not, the
+# client's connection cannot be trusted anymore.
+#
+def isServerError(e):
+    return isinstance(e, (Errors.EDAMUserException,
+                          Errors.EDAMSystemException,
+                          Errors.EDAMNotFoundException))
+
+#======================== Offline Mode =======================================#
+
+#
+# While offline, the server is never contacted: everything is read from the
+# metadata store and the content cache, and changes are journaled by the save
+# queue (see savequeue.py) to be uploaded once back online. Any request made
+# to the server raises OfflineError.
+#
+class OfflineError(Exception):
+    def __init__(self):
+        super(OfflineError, self).__init__('offline')
+
+offline = False
+
+def GeeknoteIsOffline():
+    return offline
+
+def GeeknoteSetOffline(enabled):
+    global offline
+    offline = enabled
+
+#======================== NoteStorePool ======================================#
+
+#
+# A bounded pool of note store clients. A Thrift client may only be used by
+# one thread at a time, so each request takes a client out of the pool for its
+# duration. Requests made at the same time (e.g. by background threads) each
+# get their own client, up to the size of the pool. Beyond that, requests wait
+# for a client to be returned, which also caps how hard the server is hit.
+#
+# Each client keeps its connection to the server open between requests (see
+# KeepAliveHttpClient in transport.py). A client whose request failed without
+# an answer from the server is closed rather than returned to the pool, and
+# is replaced by a new one (with a new connection) when next needed.
+#
+class NoteStorePool(object):
+    def __init__(self, size):
+        self.size    = max(size, 1)
+        self.clients = []
+        self.count   = 0
+        self.url     = None
+        self.cond    = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.clients and self.count >= self.size:
+                self.cond.wait()
+            if self.clients:
+                return self.clients.pop()
+            self.count += 1
+
+        try:
+            return self.createClient()
+        except:
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+
+    def createClient(self):
+        import evernote.edam.notestore.NoteStore as NoteStoreService
+        import thrift.protocol.TBinaryProtocol   as TBinaryProtocol
+
+        from transport import KeepAliveHttpClient
+
+        if self.url is None:
+            self.url = geeknote.getUserStore().getNoteStoreUrl(authToken)
+
+        transport = KeepAliveHttpClient(self.url)
+        protocol  = TBinaryProtocol.TBinaryProtocol(transport)
+        return NoteStoreService.Client(protocol)
+
+    # Return a client to the pool, or close it if it is no longer healthy.
+    def release(self, client, healthy=True):
+        with self.cond:
+            if healthy:
+                self.clients.append(client)
+            else:
+                self.count -= 1
+            self.cond.notify()
+
+        if not healthy:
+            closeClient(client)
+
+    # Close the idle clients and look up the note store's URL again.
+    def reset(self):
+        with self.cond:
+            clients = self.clients
+            self.clients = []
+            self.count  -= len(clients)
+            self.url     = None
+            self.cond.notify_all()
+
+        for client in clients:
+            closeClient(client)
+
+def closeClient(client):
+    transport = getattr(client, '_iprot', None)
+    if transport is not None:
+        transport.trans.close()
+
+def getConnectionCount():
+    if int(vim.eval('exists("g:GeeknoteConnections")')):
+        return int(vim.eval('g:GeeknoteConnections'))
+    return 4
+
+noteStorePool = NoteStorePool(getConnectionCount())
+
+#======================== Request Scheduling =================================#
+
+# Requests made per second on average (zero does not limit them).
+def getRequestRate():
+    if int(vim.eval('exists("g:GeeknoteRequestRate")')):
+        return float(vim.eval('g:GeeknoteRequestRate'))
+    return 10
+
+#
+# Seconds a request waits for the server's rate limit to be lifted before it
+# fails with RateLimitError.
+#
+def getRateLimitWait():
+    if int(vim.eval('exists("g:GeeknoteRateLimitWait")')):
+        return int(vim.eval('g:GeeknoteRateLimitWait'))
+    return 30
+
+#
+# Every request to the note store is scheduled (see RequestScheduler in
+# scheduler.py), at most one per connection at a time.
+#
+requestScheduler = RequestScheduler(getRequestRate(), noteStorePool.size)
+rateLimitWait    = getRateLimitWait()
+
+#
+# Make a request to the note store (may be called from any thread). The
+# request is made at the priority of the calling thread (see
+# requestPriority()).
+#
+# A request rejected because the token expired is made once more after
+# connecting again (see reconnect()). A request rejected because the server's
+# rate limit was reached is made again once the server says it may be, so
+# that e.g. listing many notes page by page slows down instead of failing
+# halfway through.
+#
+def callNoteStore(method, *args):
+    if offline:
+        raise OfflineError()
+
+    token = connect()
+    with stats.measure('noteStore.' + method):
+        return makeRequest(method, token, args)
+
+def makeRequest(method, token, args):
+    priority = getRequestPriority()
+    expired  = False
+    while True:
+        requestScheduler.acquire(priority, rateLimitWait)
+        try:
+            client = noteStorePool.acquire()
+            try:
+                result = getattr(client, method)(token, *args)
+            except Exception as e:
+                noteStorePool.release(client, isServerError(e))
+                if isAuthExpired(e) and not expired:
+                    expired = True
+                    token   = reconnect(token)
+                    continue
+                if isRateLimited(e):
+                    requestScheduler.pause(max(e.rateLimitDuration, 1))
+                    continue
+                raise
+        finally:
+            requestScheduler.release()
+
+        noteStorePool.release(client)
+        return result
+
+#======================== NoteCursor =========================================#
+
+#
+# Lists the notes that match a filter one page at a time, so that the first
+# notes can be shown before all of them have been downloaded. At most
+# EDAM_USER_NOTES_MAX notes are listed. Pages must be fetched one after the
+# other, but not necessarily on the same thread.
+#
+class NoteCursor(object):
+    def __init__(self, filter, pageSize):
+        self.filter   = filter
+        self.pageSize = max(pageSize, 1)
+        self.offset   = 0
+        self.total    = None
+
+    def hasMore(self):
+        if self.total is None:
+            return True
+        return self.offset < min(self.total, Limits.EDAM_USER_NOTES_MAX)
+
+    # Download the next page of notes (an empty list once all were listed).
+    def fetch(self):
+        if not self.hasMore():
+            return []
+
+        count  = min(self.pageSize, Limits.EDAM_USER_NOTES_MAX - self.offset)
+        result = callNoteStore('findNotesMetadata',
+                               self.filter, self.offset, count,
+                               getNotesMetadataSpec())
+
+        self.total   = result.totalNotes
+        self.offset += len(result.notes)
+
+        # Never ask again for a page that came back empty.
+        if not result.notes:
+            self.total = self.offset
+        return result.notes
+
+    # Iterate over the remaining pages.
+    def __iter__(self):
+        while self.hasMore():
+            notes = self.fetch()
+            if notes:
+                yield notes
+
+def getNotesMetadataSpec():
+    meta = NoteStore.NotesMetadataResultSpec()
+    meta.includeTitle             = True
+    meta.includeUpdated           = True
+    meta.includeUpdateSequenceNum = True
+    meta.includeNotebookGuid      = True
+    meta.includeTagGuids          = True
+    return meta
+
+def getSearchPageSize():
+    if int(vim.eval('exists("g:GeeknoteSearchPageSize")')):
+        return int(vim.eval('g:GeeknoteSearchPageSize'))
+    return 100
+
+#======================== Metadata Store =====================================#
+
+def openMetadataStore():
+    if int(vim.eval('exists("g:GeeknoteMetadataCache")')):
+        if not int(vim.eval('g:GeeknoteMetadataCache')):
+            return None
+
+    path = os.path.join(getScratchDirectory(), '__GeeknoteStore__.db')
+    try:
+        with startupPhase('metadata store'):
+            return MetadataStore(path)
+    except Exception:
+        return None
+
+#
+# Never show cached data that belongs to a different account. Checked once
+# connected: until then, what is stored is assumed to be the user's. The
+# account is told by its user ID, not the token, which changes every time
+# geeknote logs in (or the token is renewed).
+#
+def checkMetadataStoreOwner():
+    if metadataStore is None:
+        return
+
+    owner = getAccountId()
+    if metadataStore.getState('owner') != owner:
+        metadataStore.clear()
+        metadataStore.setState('owner', owner)
+
+#
+# Return the ID of the user that the token was issued to. Tokens carry it in
+# their U= field (in hexadecimal), ask the server for any other token.
+#
+def getAccountId():
+    m = re.search(r'(?:^|:)U=([0-9a-fA-F]+)(?::|$)', authToken)
+    if m:
+        return str(int(m.group(1), 16))
+    return str(geeknote.getUserStore().getUser(authToken).id)
+
+metadataStore = openMetadataStore()
+
+def getContentCacheEntries():
+    if int(vim.eval('exists("g:GeeknoteContentCacheEntries")')):
+        return int(vim.eval('g:GeeknoteContentCacheEntries'))
+    return 32
+
+# Bytes of content kept on disk (if the metadata store is enabled).
+def getContentCacheBytes():
+    size = 64
+    if int(vim.eval('exists("g:GeeknoteContentCacheSize")')):
+        size = int(vim.eval('g:GeeknoteContentCacheSize'))
+    return size * 1024 * 1024
+
+contentCache = ContentCache(
+    metadataStore, getContentCacheEntries(), getContentCacheBytes())
+
+textCache = TextCache(
+    metadataStore, getContentCacheEntries(), getContentCacheBytes())
+
+#
+# The following return what was last stored for the account, or None when
+# nothing was stored yet (in which case the server must be asked instead).
+#
+def GeeknoteGetCachedNoteCounts():
+    if metadataStore is None:
+        return None
+    return metadataStore.getState('noteCounts')
+
+def GeeknoteGetCachedNotebook(guid):
+    if metadataStore is None:
+        return None
+    return metadataStore.getNotebook(guid)
+
+# Return the metadata of every note if all of it was listed (None otherwise).
+def GeeknoteGetCachedAllNotes():
+    if metadataStore is None or not metadataStore.getState('allNotes'):
+        return None
+    return metadataStore.getNotes()
+
+def GeeknoteGetCachedNotebooks():
+    if metadataStore is None or not metadataStore.getState('populated'):
+        return None
+    return metadataStore.getNotebooks()
+
+def GeeknoteGetCachedTags():
+    if metadataStore is None or not metadataStore.getState('populated'):
+        return None
+    return metadataStore.getTags()
+
+#
+# While offline, whatever notes of the notebook/tag were stored are returned
+# even if they were never listed in full.
+#
+def GeeknoteGetCachedNotebookNotes(notebook):
+    if metadataStore is None:
+        return None
+    if not offline and not metadataStore.hasListing(notebook.guid):
+        return None
+    return metadataStore.getNotes(notebookGuid=notebook.guid)
+
+def GeeknoteGetCachedTagNotes(tag):
+    if metadataStore is None:
+        return None
+    if not offline and not metadataStore.hasListing(tag.guid):
+        return None
+    return metadataStore.getNotes(tagGuid=tag.guid)
+
+#
+# Forget which notebook/tag listings are complete. Called before refreshing
+# from the server so that expanding a node fetches its notes again.
+#
+def GeeknoteInvalidateCachedListings():
+    if metadataStore is not None:
+        metadataStore.clearListings()
+        metadataStore.setState('allNotes', False)
+
+def GeeknoteSetCachePopulated():
+    if metadataStore is not None:
+        metadataStore.setState('populated', True)
+
+#
+# Add the text of a note's content (as shown in its buffer) to the local
+# search index. 'note.content' must be the ENML that the text came from.
+#
+def GeeknoteIndexNoteText(note, text):
+    if metadataStore is not None:
+        contentHash = hashlib.md5(note.content).digest()
+        metadataStore.putNoteText(note.guid, contentHash, note.title, text)
+
+#
+# Search the titles and text of the notes that are stored locally. Returns
+# None if the search must be made by the server instead: local search is
+# disabled or the query uses Evernote's search grammar (e.g. "tag:name").
+#
+def GeeknoteSearchLocally(searchWords):
+    if metadataStore is None:
+        return None
+
+    if int(vim.eval('exists("g:GeeknoteLocalSearch")')):
+        if not int(vim.eval('g:GeeknoteLocalSearch')):
+            return None
+
+    if not re.match(r'^[\w\s]+$', searchWords.decode('utf8'), re.UNICODE):
+        return None
+
+    return metadataStore.searchNotes(searchWords, Limits.EDAM_USER_NOTES_MAX)
+
+#======================== Note Store Calls ===================================#
 
 def GeeknoteCreateNewNote(note):
-    return noteStore.createNote(authToken, note)
+    note = callNoteStore('createNote', note)
+    if metadataStore is not None:
+        metadataStore.putNotes([note])
+    return note
 
 def GeeknoteCreateNewNotebook(notebook):
-    return noteStore.createNotebook(authToken, notebook)
+    notebook = callNoteStore('createNotebook', notebook)
+    if metadataStore is not None:
+        metadataStore.putNotebooks([notebook])
+    return notebook
 
 def GeeknoteFindNoteCounts():
-    return noteStore.findNoteCounts(authToken, NoteStore.NoteFilter(), False)
+    counts = callNoteStore('findNoteCounts', NoteStore.NoteFilter(), False)
+    if metadataStore is not None:
+        metadataStore.setState('noteCounts', counts)
+    return counts
+
+# Download all notes that match the filter, with as few requests as possible.
+def GeeknoteFindNotes(filter):
+    notes = []
+    for page in NoteCursor(filter, Limits.EDAM_USER_NOTES_MAX):
+        notes += page
+    return notes
+
+#
+# Download the metadata of every note in the account. A single listing tells
+# which notes belong to each notebook/tag, see NoteIndex in explorer.py.
+#
+def GeeknoteGetAllNotes():
+    filter = NoteStore.NoteFilter(order = Types.NoteSortOrder.UPDATED)
+
+    notes = GeeknoteFindNotes(filter)
+    if metadataStore is not None:
+        metadataStore.setAllNotes(notes)
+        metadataStore.setState('allNotes', True)
+    return notes
 
 def GeeknoteGetDefaultNotebook():
-    return noteStore.getDefaultNotebook(authToken)
+    if metadataStore is not None:
+        for notebook in metadataStore.getNotebooks():
+            if notebook.defaultNotebook:
+                return notebook
+    if offline:
+        return None
+    return callNoteStore('getDefaultNotebook')
 
+#
+# Search for notes. The results are listed page by page: pass the returned
+# cursor to GeeknoteGetNextNotes() to download each page.
+#
 def GeeknoteGetNotes(searchWords=""):
     filter = NoteStore.NoteFilter(order = Types.NoteSortOrder.UPDATED)
     filter.words = searchWords
 
-    meta = NoteStore.NotesMetadataResultSpec()
-    meta.includeTitle        = True
-    meta.includeNotebookGuid = True
-    meta.includeTagGuids     = True
-
-    count  = Limits.EDAM_USER_NOTES_MAX
-    result = noteStore.findNotesMetadata(authToken, filter, 0, count, meta)
-    update_count = lambda c: max(c - len(result.notes), 0)
-    count = update_count(count)
-    
-    while ((result.totalNotes != len(result.notes)) and count != 0):
-        offset = len(result.notes)
-        result.notes += noteStore.findNotesMetadata(
-            authToken, filter, offset, count, meta).notes
-        count = update_count(count)
-
-    notes = []
-    for key, note in enumerate(result.notes):
-        notes.append(note)
+    return NoteCursor(filter, getSearchPageSize())
 
+def GeeknoteGetNextNotes(cursor):
+    notes = cursor.fetch()
+    if metadataStore is not None:
+        metadataStore.putNotes(notes)
     return notes
 
 def GeeknoteGetNotebook(guid):
     try:
-        return noteStore.getNotebook(authToken, guid)
+        notebook = callNoteStore('getNotebook', guid)
     except:
         return None
 
+    if metadataStore is not None:
+        metadataStore.putNotebooks([notebook])
+    return notebook
+
+def GeeknoteGetNotebookNotes(notebook):
+    filter = NoteStore.NoteFilter(order = Types.NoteSortOrder.UPDATED)
+    filter.notebookGuid = notebook.guid
+
+    notes = GeeknoteFindNotes(filter)
+    if metadataStore is not None:
+        metadataStore.setNotebookNotes(notebook.guid, notes)
+    return notes
+
 def GeeknoteGetNotebooks():
-    return noteStore.listNotebooks(authToken)
+    notebooks = callNoteStore('listNotebooks')
+    if metadataStore is not None:
+        metadataStore.setNotebooks(notebooks)
+    return notebooks
+
+# Load the given notebooks (all notebooks if no GUIDs are given).
+def GeeknoteGetNotebooksByGuid(guids=None):
+    if guids is None:
+        return GeeknoteGetNotebooks()
+
+    notebooks = []
+    for guid in guids:
+        notebook = GeeknoteGetNotebook(guid)
+        if notebook is not None:
+            notebooks.append(notebook)
+    return notebooks
+
+def GeeknoteGetSyncState():
+    return callNoteStore('getSyncState')
+
+def GeeknoteGetTagNotes(tag):
+    filter = NoteStore.NoteFilter(order = Types.NoteSortOrder.UPDATED)
+    filter.tagGuids = [tag.guid]
+
+    notes = GeeknoteFindNotes(filter)
+    if metadataStore is not None:
+        metadataStore.setTagNotes(tag.guid, notes)
+    return notes
 
 def GeeknoteGetTags():
-    return noteStore.listTags(authToken)
+    tags = callNoteStore('listTags')
+    if metadataStore is not None:
+        metadataStore.setTags(tags)
+    return tags
 
+#
+# Load a note along with its content. The content is only downloaded if it is
+# not cached or changed since it was cached (while offline, whatever was
+# cached is returned as is). 'note' may be note metadata.
+#
 def GeeknoteLoadNote(note):
-    return noteStore.getNote(authToken, note.guid, True, False, False, False)
+    cached = contentCache.get(note.guid)
+    stats.countLookup('contentCache', cached is not None)
+    if cached is not None and offline:
+        return cached
+
+    if cached is not None:
+        # Nothing changed since the note was cached.
+        usn = getattr(note, 'updateSequenceNum', None)
+        if usn is not None and usn == cached.updateSequenceNum:
+            return cached
+
+        # Only the note's metadata changed.
+        meta = GeeknoteRefreshNoteMeta(note)
+        if meta.contentHash == cached.contentHash:
+            meta.content = cached.content
+            contentCache.put(meta)
+            return meta
+
+    note = callNoteStore('getNote', note.guid, True, False, False, False)
+    contentCache.put(note)
+    return note
 
 def GeeknoteRefreshNoteMeta(note):
-    return noteStore.getNote(authToken, note.guid, False, False, False, False)
+    return callNoteStore('getNote', note.guid, False, False, False, False)
 
 def GeeknoteUpdateNote(note):
-    noteStore.updateNote(authToken, note)
+    content = note.content
+
+    note = callNoteStore('updateNote', note)
+    if metadataStore is not None:
+        metadataStore.putNotes([note])
+
+    # The server does not send back the content that was uploaded.
+    if note.content is None and content is not None:
+        note.content = content
+    contentCache.put(note)
+    return note
+
+#
+# Upload the note's title and notebook only. Its content (and everything else)
+# is left as is on the server.
+#
+def GeeknoteUpdateNoteMeta(note):
+    meta = Types.Note()
+    meta.guid         = note.guid
+    meta.title        = note.title
+    meta.notebookGuid = note.notebookGuid
+
+    meta = callNoteStore('updateNote', meta)
+    if metadataStore is not None:
+        metadataStore.putNotes([meta])
+    return meta
 
 def GeeknoteUpdateNotebook(notebook):
-    noteStore.updateNotebook(authToken, notebook)
+    callNoteStore('updateNotebook', notebook)
+    if metadataStore is not None:
+        metadataStore.putNotebooks([notebook])
+
+#
+# Bring the metadata store up-to-date with the server: note counts, notebooks,
+# tags, and the notes of any notebooks/tags whose GUIDs are given in
+# 'expandedGuids' (or of all notes if 'allNotes' is set). Vim is not used, so
+# this may run on a background thread.
+#
+def GeeknoteFetchAccount(notebookGuids, expandedGuids, allNotes=False):
+    state = GeeknoteGetSyncState()
+    GeeknoteInvalidateCachedListings()
+    GeeknoteFindNoteCounts()
+
+    notebooks = GeeknoteGetNotebooksByGuid(notebookGuids)
+    tags      = GeeknoteGetTags()
+
+    if allNotes:
+        GeeknoteGetAllNotes()
+        expandedGuids = []
+
+    for notebook in notebooks:
+        if notebook.guid in expandedGuids:
+            GeeknoteGetNotebookNotes(notebook)
+
+    for tag in tags:
+        if tag.guid in expandedGuids:
+            GeeknoteGetTagNotes(tag)
+
+    GeeknoteSetCachePopulated()
+    GeeknoteSetSyncState(state)
+
+#======================== Synchronization ====================================#
+
+# Maximum number of objects requested per sync chunk.
+SyncChunkMaxEntries = 1000
+
+#
+# Everything that changed in the account since the last synchronization, as
+# reported by the server's sync chunks. Notes that were moved to the trash are
+# reported in 'notes' with their 'active' flag cleared.
+#
+class SyncDelta(object):
+    def __init__(self):
+        self.notes             = []
+        self.notebooks         = []
+        self.tags              = []
+        self.expungedNotes     = []
+        self.expungedNotebooks = []
+        self.expungedTags      = []
+
+    def addChunk(self, chunk):
+        self.notes             += chunk.notes             or []
+        self.notebooks         += chunk.notebooks         or []
+        self.tags              += chunk.tags              or []
+        self.expungedNotes     += chunk.expungedNotes     or []
+        self.expungedNotebooks += chunk.expungedNotebooks or []
+        self.expungedTags      += chunk.expungedTags      or []
+
+    def isEmpty(self):
+        return not (self.notes or self.notebooks or self.tags or
+                    self.expungedNotes or self.expungedNotebooks or
+                    self.expungedTags)
+
+    # Merge changes that were reported after the ones in this delta.
+    def merge(self, delta):
+        self.notes             += delta.notes
+        self.notebooks         += delta.notebooks
+        self.tags              += delta.tags
+        self.expungedNotes     += delta.expungedNotes
+        self.expungedNotebooks += delta.expungedNotebooks
+        self.expungedTags      += delta.expungedTags
+
+def isNoteActive(note):
+    return note.active is not False and not note.deleted
+
+#
+# Remember the update count of the account as of the last complete download
+# so that the next sync only needs to ask for what changed after it.
+#
+def GeeknoteSetSyncState(state):
+    if metadataStore is not None:
+        metadataStore.setState('updateCount', state.updateCount)
+        metadataStore.setState('syncTime'   , state.currentTime)
+
+#
+# Download everything that changed since the last sync and apply it to the
+# metadata store. Returns the changes as a SyncDelta, or None if the account
+# cannot be synchronized incrementally (nothing was stored yet, or the server
+# requires a full sync), in which case everything must be refreshed.
+#
+def GeeknoteGetSyncDelta():
+    if metadataStore is None:
+        return None
+
+    updateCount = metadataStore.getState('updateCount')
+    syncTime    = metadataStore.getState('syncTime')
+    if updateCount is None or syncTime is None:
+        return None
+
+    state = GeeknoteGetSyncState()
+    if state.fullSyncBefore > syncTime or state.updateCount < updateCount:
+        return None
+
+    delta  = SyncDelta()
+    filter = NoteStore.SyncChunkFilter()
+    filter.includeNotes     = True
+    filter.includeNotebooks = True
+    filter.includeTags      = True
+    filter.includeExpunged  = True
+
+    usn = updateCount
+    while usn < state.updateCount:
+        chunk = callNoteStore(
+            'getFilteredSyncChunk', usn, SyncChunkMaxEntries, filter)
+        delta.addChunk(chunk)
+        if chunk.chunkHighUSN is None or chunk.chunkHighUSN <= usn:
+            break
+        usn = chunk.chunkHighUSN
+
+    active  = [n for n in delta.notes if isNoteActive(n)]
+    removed = [n.guid for n in delta.notes if not isNoteActive(n)]
+
+    metadataStore.putNotebooks(delta.notebooks)
+    metadataStore.putTags(delta.tags)
+    metadataStore.putNotes(active)
+    metadataStore.deleteNotes(removed + delta.expungedNotes)
+    contentCache.delete(removed + delta.expungedNotes)
+    metadataStore.deleteNotebooks(delta.expungedNotebooks)
+    metadataStore.deleteTags(delta.expungedTags)
+    GeeknoteSetSyncState(state)
+
+    return delta
 
+#
+# Synchronize the metadata store: incrementally if possible, otherwise by
+# downloading everything (see GeeknoteFetchAccount). Returns the SyncDelta of
+# an incremental sync or None after a full download. Vim is not used, so this
+# may run on a background thread.
+#
+def GeeknoteSyncAccount(notebookGuids, expandedGuids, allNotes=False):
+    delta = GeeknoteGetSyncDelta()
+    if delta is None:
+        GeeknoteFetchAccount(notebookGuids, expandedGuids, allNotes)
+    return delta
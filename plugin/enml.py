@@ -2,48 +2,118 @@ import vim
 import os
 import re
 
-from geeknote.out import *
-from bs4          import BeautifulSoup
+from HTMLParser import HTMLParser
 
-def ENMLtoText(contentENML):
+import stats
+
+#
+# Geeknote's editor and BeautifulSoup take a while to load and are only
+# needed for ENML that the plain text conversions below do not handle (or for
+# formats other than the default). They are imported when first needed.
+#
+def getEditor():
+    from geeknote.out import Editor
+    return Editor
+
+# Matches the opening tag of a <pre> element.
+PreTagRegex = re.compile(r'<pre(?:\s[^>]*)?>', re.IGNORECASE)
+
+# Matches the spaces that are stripped from the end of each line of text.
+TrailingSpaceRegex = re.compile(r' *\n')
+
+def getFormat():
     format = 'vim-default'
     if int(vim.eval('exists("g:GeeknoteFormat")')):
         format = vim.eval('g:GeeknoteFormat')
 
     if format == 'pre':
         print 'WARNING: g:GeeknoteFormat=pre is deprecated.'
+    return format
+
+@stats.measured('ENMLtoText')
+def ENMLtoText(contentENML, format=None):
+    if format is None:
+        format = getFormat()
 
     if format == 'vim-default' or format == 'pre':
         try:
-            soup = BeautifulSoup(contentENML.decode('utf-8'))
-            sections = soup.select('pre')
-            if len(sections) >= 1:
-                content = ''
-                for c in sections[0].contents:
-                    content = u''.join((content, c))
-                content = re.sub(r' *\n', os.linesep, content)
-                return content.encode('utf-8')
+            content = preToText(contentENML)
+            if content is None:
+                content = preToTextWithSoup(contentENML)
+            if content is not None:
+                return content
         except:
             pass
             # fall-through
-    return Editor.ENMLtoText(contentENML)
+    return getEditor().ENMLtoText(contentENML)
 
-def textToENML(content):
-    format = 'vim-default'
-    if int(vim.eval('exists("g:GeeknoteFormat")')):
-        format = vim.eval('g:GeeknoteFormat')
+#
+# Return the text of the first <pre> element (None if there is none or if it
+# contains anything but text). The ENML is scanned once, without building a
+# document tree.
+#
+def preToText(contentENML):
+    m = PreTagRegex.search(contentENML)
+    if m is None:
+        return None
 
-    if format == 'pre':
-        print 'WARNING: g:GeeknoteFormat=pre is deprecated.'
+    end = contentENML.find('</pre>', m.end())
+    if end == -1:
+        return None
+
+    content = contentENML[m.end():end]
+    if '<' in content:
+        return None
+
+    #
+    # Unescape the entities produced by textToENML() directly ('&amp;' last
+    # so that it does not create new entities). Leave any other entities to
+    # the HTML parser.
+    #
+    if '&' in content:
+        content = content.replace('&lt;', '<')
+        content = content.replace('&gt;', '>')
+        content = content.replace('&quot;', '"')
+        content = content.replace('&amp;', '\0')
+        if '&' in content:
+            content = content.decode('utf-8')
+            content = HTMLParser().unescape(content).encode('utf-8')
+        content = content.replace('\0', '&')
+
+    content.decode('utf-8')
+    return TrailingSpaceRegex.sub(os.linesep, content)
+
+#
+# Same as preToText() for the <pre> element as parsed by BeautifulSoup. Used
+# for ENML that preToText() does not handle.
+#
+def preToTextWithSoup(contentENML):
+    from bs4 import BeautifulSoup
 
+    soup = BeautifulSoup(contentENML.decode('utf-8'))
+    sections = soup.select('pre')
+    if len(sections) >= 1:
+        content = u''.join(sections[0].contents)
+        content = TrailingSpaceRegex.sub(os.linesep, content)
+        return content.encode('utf-8')
+    return None
+
+@stats.measured('textToENML')
+def textToENML(content):
+    format = getFormat()
     if format != 'vim-default' and format != 'pre':
-        return Editor.textToENML(content, True, format) 
+        return getEditor().textToENML(content, True, format)
 
+    #
+    # Escape the text as is: '&' must be escaped first so that the entities
+    # produced for '<' and '>' are not escaped again. Decoding checks that
+    # the text is valid UTF-8 and leaves it unchanged.
+    #
+    content.decode('utf-8')
+    content = content.replace('&', '&amp;')
     content = content.replace('<', '&lt;')
     content = content.replace('>', '&gt;')
-    content = content.replace('&', '&amp;')
-    content = unicode(content, "utf-8")
-    contentHTML = u''.join(('<pre>', content, '</pre>')).encode("utf-8")
+    contentHTML = ''.join(('<pre>', content, '</pre>'))
 
-    enml = Editor.wrapENML(contentHTML)
+    enml = getEditor().wrapENML(contentHTML)
     return enml
@@ -6,6 +6,9 @@ from utils  import *
 from conn   import *
 from change import *
 
+import stats
+import worker
+
 #======================== Global Setup/Config ================================#
 
 ExplorerCharOpened = u'\u25bd'
@@ -19,11 +22,64 @@ if int(vim.eval('exists("g:GeeknoteExplorerNodeClosed")')):
     ExplorerCharClosed = vim.eval(
         'g:GeeknoteExplorerNodeClosed').decode('utf8')
 
+# Shown in place of the notes of a notebook/tag while they are being loaded.
+ExplorerTextLoading = u'loading\u2026'
+
+# Shown below search results when more of them can be loaded.
+ExplorerTextMore = u'more\u2026'
+
+# Shown in place of the notes of a notebook/tag that are not rendered yet.
+ExplorerTextHidden = u'\u2026 {} more'
+
+#
+# The number of notes rendered under an expanded notebook/tag. More are
+# rendered, this many at a time, as the user scrolls down to the end of them.
+# Zero renders all notes at once.
+#
+ExplorerPageSize = 500
+
+if int(vim.eval('exists("g:GeeknoteExplorerPageSize")')):
+    ExplorerPageSize = int(vim.eval('g:GeeknoteExplorerPageSize'))
+
+#
+# Workers used to make several requests at the same time (to load the notes of
+# several notebooks/tags or to save several changes).
+#
+prefetchPool = worker.WorkerPool(noteStorePool.size, threaded=True)
+
+#
+# Patterns that match the lines of the navigation buffer. They are used to
+# find out what the user changed (see Explorer.applyChanges()).
+#
+NotebookRegexWithCount = re.compile(
+    "^\S+"     # match leading non-whitespace characters
+    "(?:\s+)?" # optional whitespace
+    "(.*)"     # notebook name
+    "\(\d+\)"  # note count
+    "(?:\s+)?" # optional whitespace
+    "N\[.*\]"  # key
+    ".*$")     # everything else till end of line
+
+NotebookRegex = re.compile(
+    "^\S+"     # match leading non-whitespace characters
+    "(?:\s+)?" # optional whitespace
+    "(.*)"     # notebook name
+    "N\[.*\]"  # key
+    ".*$")     # everything else till end of line
+
+NoteRegex = re.compile(
+    "^\s+"     # leading whitespace
+    "(.*)"     # note title
+    "n\[.*\]"  # key
+    ".*$")     # everything else till end of line
+
+KeyRegex = re.compile('^.+\[(.+)\]$')
+
 #======================== Registry ===========================================#
 
 #
 # A dictionary containing an entry for all nodes contained in the explorer
-# window, keyed by guid.
+# window, keyed by node key (see registerNode()).
 #
 registry = {}
 
@@ -36,6 +92,17 @@ registry = {}
 #
 instanceMap = {}
 
+# Maps GUIDs to the list of all nodes that represent the object.
+guidMap = {}
+
+#
+# Maps row numbers (starting at one, like Vim's line numbers) to the nodes
+# shown on those rows of the navigation buffer, and to the notebook/tag that
+# each row belongs to.
+#
+rowMap    = {}
+parentMap = {}
+
 def registerNode(node):
     guid = node.getGuid()
     if guid not in instanceMap:
@@ -47,10 +114,28 @@ def registerNode(node):
 
     key = guid + "(" + str(instance) + ")"
     node.setKey(key)
+    node.instance = instance
     registry[key] = node
+    guidMap.setdefault(guid, []).append(node)
 
 def deleteNodes():
     registry.clear()
+    instanceMap.clear()
+    guidMap.clear()
+    clearRows()
+
+def unregisterNode(node):
+    for child in node.children:
+        unregisterNode(child)
+
+    key = node.getKey()
+    if key in registry:
+        del registry[key]
+
+        nodes = guidMap[node.getGuid()]
+        nodes.remove(node)
+        if len(nodes) == 0:
+            del guidMap[node.getGuid()]
 
 def getNode(key):
     if key in registry:
@@ -58,8 +143,132 @@ def getNode(key):
     return None 
 
 def getNodeByInstance(guid, instance):
-    key = guid + "(" + str(instance) + ")"
-    return getNode(key)
+    for node in guidMap.get(guid, []):
+        if node.instance == instance:
+            return node
+    return None
+
+def getNodesByGuid(guid):
+    return list(guidMap.get(guid, []))
+
+def getNodeByRow(row):
+    return rowMap.get(row)
+
+# Return the notebook/tag that the given row belongs to (if any).
+def getParentByRow(row):
+    return parentMap.get(row)
+
+#
+# Record that the node is shown on the given row. Rows must be set in order
+# (see clearRows()).
+#
+def setNodeRow(node, row, parent=None):
+    node.row       = row
+    rowMap[row]    = node
+    parentMap[row] = parent
+
+#
+# Record that the notes of the given notebook/tag that are not rendered are
+# summarized on the given row (see ExplorerTextHidden). Such rows have a
+# parent but no node.
+#
+def setHiddenRow(row, parent):
+    parentMap[row] = parent
+
+# Return the notebook/tag whose hidden notes are summarized on the given row.
+def getHiddenParentByRow(row):
+    if row in rowMap:
+        return None
+    return parentMap.get(row)
+
+# Forget the rows of all nodes (they are not shown anywhere).
+def clearRows():
+    for node in rowMap.values():
+        node.row = -1
+    rowMap.clear()
+    parentMap.clear()
+
+#======================== NoteIndex ==========================================#
+
+#
+# The notes of every notebook and tag, built from a single listing of all
+# notes in the account (see GeeknoteGetAllNotes). Each note's metadata tells
+# which notebook it belongs to and which tags are applied to it, so nodes can
+# be expanded without asking the server. Used when g:GeeknoteLoadAllNotes is
+# set.
+#
+class NoteIndex(object):
+    def __init__(self, notes):
+        self.notes     = {}
+        self.notebooks = {}
+        self.tags      = {}
+
+        # Notes are listed most recently updated first.
+        for note in notes:
+            self.add(note)
+
+    def add(self, note, index=None):
+        self.notes[note.guid] = note
+
+        groups = [(self.notebooks, note.notebookGuid)]
+        for tagGuid in (note.tagGuids or []):
+            groups.append((self.tags, tagGuid))
+
+        for table, guid in groups:
+            notes = table.setdefault(guid, [])
+            if index is None:
+                notes.append(note)
+            else:
+                notes.insert(index, note)
+
+    def getNotebookNotes(self, guid):
+        return list(self.notebooks.get(guid, []))
+
+    def getTagNotes(self, guid):
+        return list(self.tags.get(guid, []))
+
+    def remove(self, guid):
+        note = self.notes.pop(guid, None)
+        if note is None:
+            return
+
+        self.removeFrom(self.notebooks, note.notebookGuid, guid)
+        for tagGuid in (note.tagGuids or []):
+            self.removeFrom(self.tags, tagGuid, guid)
+
+    def removeFrom(self, table, key, guid):
+        notes = table.get(key, [])
+        for i, note in enumerate(notes):
+            if note.guid == guid:
+                del notes[i]
+                break
+
+    def removeTag(self, guid):
+        self.tags.pop(guid, None)
+
+    #
+    # Re-file a note that was created, changed, or moved. It is now the most
+    # recently updated note of its notebook.
+    #
+    def update(self, note):
+        self.remove(note.guid)
+        self.add(note, 0)
+
+# Set when all notes are listed at once (see NoteIndex).
+noteIndex = None
+
+def isNoteIndexEnabled():
+    if int(vim.eval('exists("g:GeeknoteLoadAllNotes")')):
+        return int(vim.eval('g:GeeknoteLoadAllNotes')) != 0
+    return False
+
+def setNoteIndex(notes):
+    global noteIndex
+
+    if notes is None:
+        noteIndex = None
+    else:
+        noteIndex = NoteIndex(notes)
 
 #======================== Node ===============================================#
 
@@ -71,7 +280,10 @@ class Node(object):
         self.row       = -1
         self.indent    = indent
         self.prefWidth = 0
+        self.rowCount  = 0
         self.key       = ""
+        self.instance  = 0
+        self.pending   = None
         self.close()
 
     def activate(self):
@@ -80,35 +292,88 @@ class Node(object):
     def adapt(self, line):
         return False
 
-    def addChild(self, node):
+    def addChild(self, node, index=None):
         node.parent = self
-        self.children.append(node)
+        if index is None:
+            self.children.append(node)
+        else:
+            self.children.insert(index, node)
 
     def close(self):
         self.expanded = False
+        self.shown    = ExplorerPageSize
 
-    def commitChanges(self):
+    # Add the node's changes to the given ChangeBatch.
+    def commitChanges(self, batch):
         for change in self.changes:
-            change.apply()
+            batch.add(change)
         del self.changes[:]
 
     def expand(self):
         self.expanded = True
 
+    # Download the node's notes from the server (runs on a worker thread).
+    def fetchNotes(self):
+        return []
+
     def getGuid(self):
         return "None"
 
     def getKey(self):
         return self.key
 
-    def getPreferredWidth(self):
-        if self.parent is None or self.parent.isExpanded():
-            return self.prefWidth
-        return 0
+    # Return the node's notes if they are available locally (None otherwise).
+    def getNotes(self):
+        return None
+
+    # Return the Future of the load in progress for this node (if any).
+    def getPending(self):
+        return self.pending
+
+    # Return the number of children that are not rendered (see showMore()).
+    def getHiddenCount(self):
+        if self.shown == 0:
+            return 0
+        return max(len(self.children) - self.shown, 0)
+
+    # Return the children that are rendered.
+    def getShownChildren(self):
+        if self.shown == 0:
+            return self.children
+        return self.children[:self.shown]
 
     def isExpanded(self):
         return self.expanded
 
+    def isLoading(self):
+        return self.pending is not None
+
+    #
+    # Load the node's notes unless they are loaded (or being loaded) already.
+    # Notes that are not available locally are downloaded by the given pool
+    # of workers, with requests of the given priority. The node shows a
+    # placeholder until they arrive (see getPending()).
+    #
+    def load(self, pool=None, priority=PriorityInteractive):
+        if self.loaded or self.pending is not None:
+            return
+
+        notes = self.getNotes()
+        if notes is not None:
+            self.setNotes(notes)
+            return
+
+        if pool is None:
+            pool = worker.pool
+        self.pending = pool.submit(callWithPriority, priority, self.fetchNotes)
+        self.pending.then(self.setNotes, self.onLoadFailed)
+
+    def onLoadFailed(self, e):
+        self.pending = None
+        self.close()
+        vim.command('echomsg "Geeknote: failed to load {} ({})"'.format(
+            self.name, str(e).replace('"', "'")))
+
     def isVisible(self):
         return self.row != -1
 
@@ -122,6 +387,19 @@ class Node(object):
         if node in self.children:
             self.children.remove(node)
 
+    # Make sure the given child is rendered.
+    def reveal(self, node):
+        if self.shown == 0:
+            return
+        index = self.children.index(node)
+        if index >= self.shown:
+            self.shown = index + 1
+
+    # Render the next ExplorerPageSize children as well.
+    def showMore(self):
+        if self.shown != 0:
+            self.shown += ExplorerPageSize
+
     def setName(self, name):
         self.name = name
 
@@ -143,19 +421,9 @@ class NotebookNode(Node):
 
     def adapt(self, line):
         if len(self.children) > 0:
-            r = re.compile("^\S+"     # match leading non-whitespace characters 
-                           "(?:\s+)?" # optional whitespace
-                           "(.*)"     # notebook name
-                           "\(\d+\)"  # note count
-                           "(?:\s+)?" # optional whitespace
-                           "N\[.*\]"  # key
-                           ".*$")     # everything else till end of line
+            r = NotebookRegexWithCount
         else:
-            r = re.compile("^\S+"     # match leading non-whitespace characters
-                           "(?:\s+)?" # optional whitespace
-                           "(.*)"     # notebook name
-                           "N\[.*\]"  # key
-                           ".*$")     # everything else till end of line
+            r = NotebookRegex
 
         m = r.match(line)
         if m:
@@ -168,31 +436,68 @@ class NotebookNode(Node):
                 return True
         return False
 
-    def addNote(self, note):
+    def addNote(self, note, index=None):
         node = NoteNode(note, self.indent + 1)
         registerNode(node)
 
-        self.addChild(node)
+        self.addChild(node, index)
         return node
 
     def expand(self):
-        if self.loaded is False:
-            del self.children[:]
-
-            notes = self.getNotes()
-            for note in notes:
-                self.addNote(note)
-
-            self.loaded = True
-
         super(NotebookNode, self).expand()
+        self.load()
+
+    def fetchNotes(self):
+        return GeeknoteGetNotebookNotes(self.notebook)
 
     def getGuid(self):
         return self.notebook.guid
 
+    # Return the notes if they are available locally (None otherwise).
     def getNotes(self):
-        searchWords = 'notebook:"%s"' % self.notebook.name
-        return GeeknoteGetNotes(searchWords)
+        if noteIndex is not None:
+            return noteIndex.getNotebookNotes(self.notebook.guid)
+        return GeeknoteGetCachedNotebookNotes(self.notebook)
+
+    def getNoteNode(self, guid):
+        for node in self.children:
+            if node.getGuid() == guid:
+                return node
+        return None
+
+    #
+    # Show the listed notes. Nodes added before the listing arrived (notes the
+    # user moved here, see Explorer.applyChanges()) are kept along with their
+    # changes: in place of the listed note, or first if the listing was made
+    # before the move.
+    #
+    def setNotes(self, notes):
+        self.pending = None
+
+        added = {}
+        moved = []
+        for node in self.children:
+            if node.getGuid() in added:
+                unregisterNode(node)
+                continue
+            added[node.getGuid()] = node
+            moved.append(node)
+
+        del self.children[:]
+        for note in notes:
+            node = added.pop(note.guid, None)
+            if node is None:
+                self.addNote(note)
+            else:
+                self.addChild(node)
+
+        index = 0
+        for node in moved:
+            if node.getGuid() in added:
+                self.addChild(node, index)
+                index += 1
+
+        self.loaded = True
 
     def render(self, buffer, attribs):
         numNotes = len(self.children)
@@ -211,15 +516,25 @@ class NotebookNode(Node):
 
         line = line.encode('utf8')
         self.prefWidth = len(line)
+        attribs['maxWidth'] = max(attribs['maxWidth'], self.prefWidth)
 
         fmt = '{:<%d} N[{}]' % attribs['keyCol']
         buffer.append(fmt.format(line, self.getKey()))
-        self.row = len(buffer)
+        setNodeRow(self, attribs['firstRow'] + len(buffer) - 1, self)
 
         if self.expanded:
-            for noteNode in self.children:
+            if self.isLoading():
+                renderLoading(buffer, self.indent + 1)
+            for noteNode in self.getShownChildren():
                 noteNode.render(buffer, attribs)
 
+            hidden = self.getHiddenCount()
+            if hidden > 0:
+                renderHidden(buffer, self.indent + 1, hidden)
+                setHiddenRow(attribs['firstRow'] + len(buffer) - 1, self)
+
+        self.rowCount = attribs['firstRow'] + len(buffer) - self.row
+
     def setName(self, name):
         self.name = name
 
@@ -235,11 +550,7 @@ class NoteNode(Node):
 
     def adapt(self, line):
         # Was the note renamed?
-        r = re.compile("^\s+"    # leading whitespace
-                       "(.*)"    # note title
-                       "n\[.*\]" # key
-                       ".*$")    # everything else till end of line
-        m = r.match(line)
+        m = NoteRegex.match(line)
         if m:
             title = m.group(1).strip()
             if self.title != title:
@@ -259,11 +570,10 @@ class NoteNode(Node):
         return self.note.guid
 
     def refresh(self):
+        note = self.note
         if self.title is not None:
-            self.note = GeeknoteRefreshNoteMeta(self.note)
-
-        self.notebookGuid = self.note.notebookGuid
-        self.setTitle(self.note.title)
+            note = GeeknoteRefreshNoteMeta(note)
+        self.setNote(note)
 
     def getGuid(self):
         return self.note.guid
@@ -273,10 +583,17 @@ class NoteNode(Node):
 
         line = line.encode('utf8')
         self.prefWidth = len(line)
+        attribs['maxWidth'] = max(attribs['maxWidth'], self.prefWidth)
 
         fmt = '{:<%d} n[{}]' % attribs['keyCol']
         buffer.append(fmt.format(line, self.getKey()))
-        self.row = len(buffer)
+        setNodeRow(self, attribs['firstRow'] + len(buffer) - 1, self.parent)
+        self.rowCount = 1
+
+    def setNote(self, note):
+        self.note         = note
+        self.notebookGuid = note.notebookGuid
+        self.setTitle(note.title)
 
     def setTitle(self, title):
         self.title = title
@@ -299,21 +616,29 @@ class TagNode(Node):
         return node
 
     def expand(self):
-        if self.loaded is False:
-            notes = self.getNotes()
-            notes.sort(key=lambda n: n.title)
-            for note in notes:
-                self.addNote(note)
-            self.loaded = True
-
         super(TagNode, self).expand()
+        self.load()
+
+    def fetchNotes(self):
+        return GeeknoteGetTagNotes(self.tag)
 
     def getGuid(self):
         return self.tag.guid
 
+    # Return the notes if they are available locally (None otherwise).
     def getNotes(self):
-        searchWords = 'tag:"%s"' % self.tag.name
-        return GeeknoteGetNotes(searchWords)
+        if noteIndex is not None:
+            return noteIndex.getTagNotes(self.tag.guid)
+        return GeeknoteGetCachedTagNotes(self.tag)
+
+    def setNotes(self, notes):
+        self.pending = None
+
+        notes.sort(key=lambda n: n.title)
+        for note in notes:
+            self.addNote(note)
+
+        self.loaded = True
 
     def render(self, buffer, attribs):
         numNotes = len(self.children)
@@ -332,15 +657,33 @@ class TagNode(Node):
 
         line = line.encode('utf8')
         self.prefWidth = len(line)
+        attribs['maxWidth'] = max(attribs['maxWidth'], self.prefWidth)
 
         fmt = '{:<%d} T[{}]' % attribs['keyCol']
         buffer.append(fmt.format(line, self.getKey()))
-        self.row = len(buffer)
+        setNodeRow(self, attribs['firstRow'] + len(buffer) - 1, self)
 
         if self.expanded:
-            for noteNode in self.children:
+            if self.isLoading():
+                renderLoading(buffer, self.indent + 1)
+            for noteNode in self.getShownChildren():
                 noteNode.render(buffer, attribs)
 
+            hidden = self.getHiddenCount()
+            if hidden > 0:
+                renderHidden(buffer, self.indent + 1, hidden)
+                setHiddenRow(attribs['firstRow'] + len(buffer) - 1, self)
+
+        self.rowCount = attribs['firstRow'] + len(buffer) - self.row
+
+def renderLoading(buffer, indent):
+    line = ' ' * (indent * 4) + ExplorerTextLoading
+    buffer.append(line.encode('utf8'))
+
+def renderHidden(buffer, indent, count):
+    line = ' ' * (indent * 4) + ExplorerTextHidden.format(count)
+    buffer.append(line.encode('utf8'))
+
 #======================== Explorer ===========================================#
 
 class Explorer(object):
@@ -350,58 +693,104 @@ class Explorer(object):
         self.notebooks     = []
         self.tags          = []
         self.modifiedNodes = []
-        self.dataFile      = None
         self.buffer        = None
         self.expandState   = {}
         self.searchResults = []
+        self.searchCursor  = None
+        self.searchPending = None
+        self.moreRow       = -1
+        self.lines         = None
+        self.keyCol        = 0
+        self.maxWidth      = 0
+        self.width         = None
+        self.refreshing    = False
+        self.stale         = False
 
-        self.refresh()
+        #
+        # Show whatever was stored locally the last time the explorer was
+        # used and bring it up-to-date in the background. Only go to the
+        # server directly when nothing was stored yet. While offline (or if
+        # the server cannot be reached), only what was stored can be shown.
+        #
+        if self.load():
+            if not GeeknoteIsOffline():
+                self.refreshInBackground()
+        else:
+            try:
+                if GeeknoteIsOffline():
+                    raise OfflineError()
+                self.refresh()
+            except OfflineError:
+                self.rebuild(None, [], [])
+                vim.command('echomsg "Geeknote: offline, nothing stored yet"')
 
-        self.dataFile = createTempFile(prefix='__GeeknoteExplorer__')
+        saveQueue.addListener(self.onSaveStatus)
 
         autocmd('VimLeave', '*', ':call Vim_GeeknoteTerminate()')
 
-    def __del__(self):
-        try:
-            self.dataFile.close()
-        except:
-            pass
-
     def activateNode(self, line):
+        row, col = vim.current.window.cursor
+        if row == self.moreRow:
+            self.fetchSearchResults()
+            return
+
+        parent = getHiddenParentByRow(row)
+        if parent is not None:
+            self.showMore(parent)
+            return
+
         key = self.getNodeKey(line)
         if key is not None:
             node = getNode(key)
             node.activate()
 
-            # Rerender the navigation window. Keep the current cursor postion.
+            # Rerender the node's lines. Keep the current cursor postion.
             row, col = vim.current.window.cursor
-            self.render()
+            self.renderNode(node)
             vim.current.window.cursor = (row, col)
 
+            # Render again once the node's content arrives.
+            self.renderWhenLoaded(node)
+
+    def showMore(self, node):
+        node.showMore()
+        self.renderNode(node)
+
+    def renderWhenLoaded(self, node):
+        pending = node.getPending()
+        if pending is not None:
+            onLoaded = lambda result: self.renderNode(node)
+            pending.then(onLoaded, onLoaded)
+
+    def onNodeLoaded(self, result):
+        self.render()
+
     def addNote(self, note):
-        notebook = getNodeByInstance(note.notebookGuid, 0)
-        node = notebook.addNote(note) 
+        if noteIndex is not None:
+            noteIndex.update(note)
 
         #
-        # Expand the notebook so that the new node can be selected. This must
-        # occur after the node is added to the notebook. If done before, it is
-        # possible for the node to get added twice.
+        # Expand the notebook so that the new node can be selected. If the
+        # notebook's notes are available locally, they already include the new
+        # note. Otherwise, the note is added to whatever is shown meanwhile.
         #
+        notebook = getNodeByInstance(note.notebookGuid, 0)
         notebook.expand()
 
+        node = notebook.getNoteNode(note.guid)
+        if node is None:
+            node = notebook.addNote(note, 0)
+        notebook.reveal(node)
+
         #
-        # Re-render the explorer window. This ensures that the new node will
-        # assigned a row number so that it can be selected.
+        # Re-render the notebook. This ensures that the new node will assigned
+        # a row number so that it can be selected.
         #
-        self.render()
+        self.renderNode(notebook)
         self.selectNode(node)
 
     def addNotebook(self, notebook):
-        node = NotebookNode(notebook)
-        registerNode(node)
-
-        self.notebooks.append(node)
-        self.notebooks.sort(key=lambda n: n.notebook.name.lower())
+        node = self.addNotebookNode(notebook)
 
         #
         # Re-render the explorer window. This ensures that the new node will
@@ -410,6 +799,14 @@ class Explorer(object):
         self.render()
         self.selectNode(node)
 
+    def addNotebookNode(self, notebook):
+        node = NotebookNode(notebook)
+        registerNode(node)
+
+        self.notebooks.append(node)
+        self.notebooks.sort(key=lambda n: n.notebook.name.lower())
+        return node
+
     def addSearchResults(self, results):
         for note in results:
             node = NoteNode(note, 0)
@@ -423,75 +820,178 @@ class Explorer(object):
 
         registerNode(tagNode)
 
+    #
+    # Find out what the user changed in the navigation buffer: nodes that were
+    # renamed and notes that were moved to another notebook. The buffer is
+    # read once from top to bottom. Every line belongs to the notebook/tag
+    # that precedes it.
+    #
+    @stats.measured('Explorer.applyChanges')
     def applyChanges(self):
-        #
-        # It is possible that user has rearranged (moved) the nodes since the
-        # last time the changes were applied. Refresh them now.
-        #
-        self.updateNodeLineNumbers()
+        clearRows()
+
+        modified = set(self.modifiedNodes)
+        parent   = None
+
+        lines = self.buffer[:]
+        for row in xrange(len(lines)):
+            line = lines[row]
+            node = getNode(self.getNodeKey(line))
+            if node is None:
+                continue
+
+            if not isinstance(node, NoteNode):
+                parent = node
+            setNodeRow(node, row + 1, parent)
+
+            changed = node.adapt(line)
+
+            # Was the note moved to another notebook?
+            if isinstance(node       , NoteNode)     and \
+               isinstance(node.parent, NotebookNode) and \
+               isinstance(parent     , NotebookNode) and \
+               node.parent is not parent:
+                change = NoteMoved(node.note, parent.notebook.guid)
+                node.changes.append(change)
+
+                parent.expand()
+                node.parent.removeChild(node)
+                parent.addChild(node)
+                parent.reveal(node)
+                changed = True
+
+            if changed and node not in modified:
+                modified.add(node)
+                self.modifiedNodes.append(node)
 
-        # Look for nodes that were renamed
-        for key in registry:
-            node = getNode(key)
-            if node.isVisible():
-                if node.adapt(self.buffer[node.row]):
-                    if node not in self.modifiedNodes:
-                        self.modifiedNodes.append(node)
+    def clearSearchResults(self):
+        for node in self.searchResults:
+            unregisterNode(node)
+        del self.searchResults[:]
 
-        # Look for nodes that were moved
-        for key in registry:
-            node = getNode(key)
-            if node.isVisible():
-                if isinstance(node       , NoteNode) and \
-                   isinstance(node.parent, NotebookNode):
-                    parent = self.getNodeParent(node.row)
-                    if (node.parent != parent):
-                        change = NoteMoved(node.note, parent.notebook.guid)
-                        node.changes.append(change)
+        self.searchCursor  = None
+        self.searchPending = None
 
-                        parent.expand()
-                        node.parent.removeChild(node)
-                        parent.addChild(node)
+    #
+    # Show the results of a search (see GeeknoteGetNotes). Only the first page
+    # is requested now. The others are requested as the user scrolls down to
+    # the end of the results (see onCursorMoved()).
+    #
+    def showSearchResults(self, cursor):
+        self.clearSearchResults()
+        self.searchCursor = cursor
+        self.fetchSearchResults()
+        self.render()
 
-                        if node not in self.modifiedNodes:
-                            self.modifiedNodes.append(node)
+    def fetchSearchResults(self):
+        cursor = self.searchCursor
+        if cursor is None or self.searchPending is not None:
+            return
+        if not cursor.hasMore():
+            return
 
-    def clearSearchResults(self):
-        del self.searchResults[:]
+        self.searchPending = worker.submit(GeeknoteGetNextNotes, cursor)
+        self.searchPending.then(
+            lambda notes: self.onSearchResults(cursor, notes),
+            lambda e: self.onSearchFailed(cursor, e))
+
+    def onSearchResults(self, cursor, notes):
+        # Ignore the results of a search that was replaced by another.
+        if cursor is not self.searchCursor:
+            return
+
+        self.searchPending = None
+        self.addSearchResults(notes)
+        self.render()
+
+    def onSearchFailed(self, cursor, e):
+        if cursor is not self.searchCursor:
+            return
+
+        self.searchPending = None
+        self.searchCursor  = None
+        self.render()
+        vim.command('echomsg "Geeknote: search failed ({})"'.format(
+            str(e).replace('"', "'")))
+
+    #
+    # Render more notes of a notebook/tag once the end of the rendered ones
+    # scrolls into view. Likewise, request the next page of search results
+    # once the end of the results scrolls into view.
+    #
+    def onCursorMoved(self):
+        while True:
+            parent = self.getVisibleHiddenParent()
+            if parent is None:
+                break
+            self.showMore(parent)
+
+        if self.moreRow == -1 or self.searchPending is not None:
+            return
+        if int(vim.eval('line("w$")')) >= self.moreRow:
+            self.fetchSearchResults()
+
+    # Return the notebook/tag whose hidden notes are summarized in view.
+    def getVisibleHiddenParent(self):
+        first = int(vim.eval('line("w0")'))
+        last  = int(vim.eval('line("w$")'))
+        for row in xrange(first, last + 1):
+            parent = getHiddenParentByRow(row)
+            if parent is not None:
+                return parent
+        return None
 
     def commitChanges(self):
+        #
+        # The buffer stays marked as modified until it is rendered again, so
+        # that render() knows that its lines differ from the ones it drew.
+        #
         if isBufferModified(self.buffer.number):
             self.applyChanges()
 
+        batch = ChangeBatch()
         for node in self.modifiedNodes:
-            node.commitChanges()
+            node.commitChanges(batch)
 
+        # Changes made while offline are uploaded once back online.
+        failures = []
+        if GeeknoteIsOffline():
+            batch.journal(saveQueue)
+        else:
+            failures = batch.commit(prefetchPool, saveQueue)
+        for changes, e in failures:
+            vim.command('echomsg "Geeknote: failed to save {} ({})"'.format(
+                changes[0].describe().replace('"', "'"),
+                str(e).replace('"', "'")))
+
+        if noteIndex is not None:
+            for node in self.modifiedNodes:
+                if isinstance(node, NoteNode):
+                    noteIndex.update(node.note)
+
+        #
+        # Show the changes in the other nodes of the same objects. They
+        # already have been saved, so there is no need to ask the server.
+        #
         for node in self.modifiedNodes:
-            for key in registry:
-                tempNode = getNode(key)
-                if tempNode.getGuid() == node.getGuid():
-                    if tempNode.getKey() != node.getKey():
-                        tempNode.refresh()
+            for tempNode in getNodesByGuid(node.getGuid()):
+                if tempNode is node:
+                    continue
+                if isinstance(tempNode, NoteNode):
+                    tempNode.setNote(node.note)
+                else:
+                    tempNode.refresh()
 
         del self.modifiedNodes[:]
 
     def getNodeParent(self, row):
-        key  = self.getNodeKey(self.buffer[row])
-        node = getNode(key)
+        node = getNodeByRow(row)
 
         # Only notes have parents
         if not isinstance(node, NoteNode):
             return None
 
-        while row > 0:
-            key = self.getNodeKey(self.buffer[row])
-            if key is not None: 
-                node = getNode(key)
-                if not isinstance(node, NoteNode):
-                    return node
-            row -= 1
-
-        return None
+        return getParentByRow(row)
 
     def getSelectedNode(self):
         if self.buffer is None:
@@ -518,52 +1018,60 @@ class Explorer(object):
         return None
 
     def getMinWidth(self):
-        maxWidth = 0
-        for key in registry:
-            width = getNode(key).getPreferredWidth()
-            if width > maxWidth:
-                maxWidth = width
-
         hpad = numberwidth() + foldcolumn() + 1
-        return maxWidth + hpad
+        return self.maxWidth + hpad
 
     def getNodeKey(self, nodeText):
-        r = re.compile('^.+\[(.+)\]$')
-        m = r.match(nodeText)
+        m = KeyRegex.match(nodeText)
         if m: 
             return m.group(1)
         return None
 
     #
-    # Hide the navigation buffer. This closes the window it is displayed in but
-    # does not destroy the buffer itself.
+    # Hide the navigation buffer. This closes the windows it is displayed in
+    # but does not unload the buffer itself, so its content is still there
+    # when it is shown again.
     #
     def hide(self):
-        vim.command('{}bunload'.format(self.buffer.number))
+        for wnum in reversed(bufwinnr(self.buffer.number)):
+            setActiveWindow(wnum)
+            if winnr('$') > 1:
+                vim.command('close!')
+            else:
+                vim.command('enew')
         self.hidden = True
 
-    def initView(self):
-        origWin = getActiveWindow()
-        setActiveBuffer(self.buffer)
-
-        wnum = getActiveWindow()
+    #
+    # Set up the navigation buffer. It is not backed by any file: writing it
+    # (e.g. ':w') saves the user's changes to the server instead (see
+    # commitChanges()).
+    #
+    def initBuffer(self):
         bnum = self.buffer.number
-         
-        autocmd('BufWritePre' , 
+
+        autocmd('BufWriteCmd',
                 '<buffer>',
-                ':call Vim_GeeknoteCommitStart()')
+                ':call Vim_GeeknoteCommitChanges()')
 
-        autocmd('BufWritePost', 
+        autocmd('CursorMoved',
                 '<buffer>',
-                ':call Vim_GeeknoteCommitComplete()')
+                ':call Vim_GeeknoteCursorMoved()')
+
+        setBufferVariable(bnum, 'buftype'  , 'acwrite')
+        setBufferVariable(bnum, 'swapfile' , False)
+        setBufferVariable(bnum, 'bufhidden', 'hide')
+
+        vim.command('setfiletype geeknote')
 
+    def initView(self):
+        origWin = getActiveWindow()
+        setActiveBuffer(self.buffer)
+
+        wnum = getActiveWindow()
         setWindowVariable(wnum, 'winfixwidth', True)
         setWindowVariable(wnum, 'wrap'       , False)
         setWindowVariable(wnum, 'cursorline' , True)
-        setBufferVariable(bnum, 'swapfile'   , False)
-        setBufferVariable(bnum, 'bufhidden'  , 'hide')
 
-        vim.command('setfiletype geeknote')
         setActiveWindow(origWin)
 
     #
@@ -573,59 +1081,284 @@ class Explorer(object):
     def isHidden(self):
         return self.hidden
 
-    def refresh(self):
+    #
+    # Rebuild all nodes from what was last stored locally. Returns False if
+    # nothing has been stored yet.
+    #
+    def load(self):
+        notebooks = GeeknoteGetCachedNotebooks()
+        tags      = GeeknoteGetCachedTags()
+        if notebooks is None or tags is None:
+            return False
+
+        if isNoteIndexEnabled():
+            notes = GeeknoteGetCachedAllNotes()
+            if notes is None:
+                return False
+            setNoteIndex(notes)
+        else:
+            setNoteIndex(None)
+
+        self.rebuild(GeeknoteGetCachedNoteCounts(), notebooks, tags)
+        return True
+
+    def rebuild(self, noteCounts, notebooks, tags):
         self.saveExpandState()
         deleteNodes()
 
-        self.noteCounts = GeeknoteFindNoteCounts()
+        self.noteCounts = noteCounts
 
         del self.notebooks[:]
-        self.refreshNotebooks()
+        for notebook in self.filterNotebooks(notebooks):
+            self.addNotebookNode(notebook)
 
         del self.tags[:]
-        tags = GeeknoteGetTags()
         for tag in tags:
             self.addTag(tag)
         self.restoreExpandState()
 
-    def refreshNotebooks(self):
+    def refresh(self):
+        state = GeeknoteGetSyncState()
+        GeeknoteInvalidateCachedListings()
+
+        noteCounts = GeeknoteFindNoteCounts()
+        notebooks  = GeeknoteGetNotebooksByGuid(self.getNotebookGuids())
+        tags       = GeeknoteGetTags()
+        GeeknoteSetCachePopulated()
+
         #
-        # If the user already specified which notebooks to load, load just
-        # those notebooks.
+        # List every note at once instead of once per expanded notebook/tag
+        # if requested.
         #
-        if int(vim.eval('exists("g:GeeknoteNotebooks")')):
-            guids = vim.eval('g:GeeknoteNotebooks')
-            for guid in guids:
-                notebook = GeeknoteGetNotebook(guid)
-                if notebook is not None:
-                    self.addNotebook(notebook)
+        if isNoteIndexEnabled():
+            setNoteIndex(GeeknoteGetAllNotes())
+        else:
+            setNoteIndex(None)
+
+        self.rebuild(noteCounts, notebooks, tags)
+        GeeknoteSetSyncState(state)
+
+    #
+    # Synchronize the metadata store on a background thread, then apply the
+    # changes to the nodes (or rebuild them if a full refresh was needed).
+    #
+    def refreshInBackground(self):
+        if self.refreshing:
             return
+        self.refreshing = True
+
+        expanded = []
+        for node in self.notebooks + self.tags:
+            if node.isExpanded():
+                expanded.append(node.getGuid())
+
+        future = worker.submit(
+            callWithPriority, PriorityBackground, GeeknoteSyncAccount,
+            self.getNotebookGuids(), expanded, isNoteIndexEnabled())
+        future.then(self.onRefreshComplete, self.onRefreshFailed)
+
+    def onRefreshComplete(self, delta):
+        self.refreshing = False
 
         #
-        # Otherwise, load all notebooks and apply any filters that the user
-        # specified (if any).
+        # Do not touch nodes that the user is currently editing in the
+        # navigation window. The latest data remains in the store and will be
+        # picked up by the next sync.
         #
-        notebooks = GeeknoteGetNotebooks()
-        if not int(vim.eval('exists("g:GeeknoteNotebookFilters")')):
-            for notebook in notebooks:
-                self.addNotebook(notebook)
+        if self.buffer is not None and isBufferModified(self.buffer.number):
+            self.stale = True
+            return
+
+        if delta is None:
+            self.load()
+        elif delta.isEmpty():
+            return
         else:
-            regex = []
-            filters = vim.eval('g:GeeknoteNotebookFilters')
-            for filter in filters:
-                try:
-                    r = re.compile(filter)
-                    regex.append(r)
-                except:
-                    pass
+            self.applySyncDelta(delta)
+        self.render()
+
+    def onRefreshFailed(self, e):
+        self.refreshing = False
+        vim.command('echomsg "Geeknote: background refresh failed ({})"'
+                    .format(str(e).replace('"', "'")))
+
+    #
+    # Bring the nodes up-to-date with the server. Only what changed since the
+    # last sync is downloaded and the affected nodes are patched in place.
+    #
+    def sync(self):
+        if self.stale:
+            self.load()
+            self.stale = False
+
+        delta = GeeknoteGetSyncDelta()
+        if delta is None:
+            self.refresh()
+        else:
+            self.applySyncDelta(delta)
+
+    def applySyncDelta(self, delta):
+        included = self.filterNotebooks(delta.notebooks)
+        for notebook in delta.notebooks:
+            node = getNodeByInstance(notebook.guid, 0)
+            if node is not None:
+                node.notebook = notebook
+                node.setName(notebook.name)
+            elif notebook in included:
+                self.addNotebookNode(notebook)
+        self.notebooks.sort(key=lambda n: n.notebook.name.lower())
+
+        for tag in delta.tags:
+            node = getNodeByInstance(tag.guid, 0)
+            if node is not None:
+                node.tag = tag
+                node.setName(tag.name)
+            else:
+                self.addTag(tag)
+        self.tags.sort(key=lambda t: t.tag.name.lower())
+
+        if noteIndex is not None:
+            for note in delta.notes:
+                if isNoteActive(note):
+                    noteIndex.update(note)
+                else:
+                    noteIndex.remove(note.guid)
+            for guid in delta.expungedNotes:
+                noteIndex.remove(guid)
+            for guid in delta.expungedTags:
+                noteIndex.removeTag(guid)
+
+        for note in delta.notes:
+            nodes = self.getNoteNodes(note.guid)
+            if isNoteActive(note):
+                for node in nodes:
+                    node.setNote(note)
+                self.placeNote(note, nodes)
+            else:
+                for node in nodes:
+                    self.removeNode(node)
+
+        for guid in delta.expungedNotes:
+            for node in self.getNoteNodes(guid):
+                self.removeNode(node)
+
+        for guid in delta.expungedNotebooks + delta.expungedTags:
+            node = getNodeByInstance(guid, 0)
+            if node is not None:
+                self.removeNode(node)
+
+    #
+    # Show notes once they are uploaded (see SaveQueue): notes created offline
+    # get their GUID from the server and conflicting copies are added.
+    #
+    def onSaveStatus(self, save, status):
+        if save.result is None:
+            return
+
+        if save.kind == 'create':
+            self.replaceNote(save.obj.guid, save.result)
+        elif save.conflict is not None:
+            self.placeNote(save.conflict, [])
+        else:
+            return
+        self.render()
+
+    # Show the given note in place of the note with the given GUID.
+    def replaceNote(self, guid, note):
+        # Keep any changes made to the nodes, their keys are about to change.
+        if self.buffer is not None and isBufferModified(self.buffer.number):
+            self.applyChanges()
+
+        for node in self.getNoteNodes(guid):
+            unregisterNode(node)
+            node.setNote(note)
+            registerNode(node)
+
+        if noteIndex is not None:
+            noteIndex.remove(guid)
+            noteIndex.update(note)
 
-            for notebook in notebooks:
-                for r in regex:
-                    if r.search(notebook.name):
-                        self.addNotebook(notebook)
-                        break
+    def getNoteNodes(self, guid):
+        nodes = getNodesByGuid(guid)
+        return [node for node in nodes if isinstance(node, NoteNode)]
+
+    #
+    # Make sure the note is shown in its notebook and tags (if they have been
+    # loaded) and nowhere else. 'nodes' are the note's existing nodes.
+    #
+    def placeNote(self, note, nodes):
+        parents = []
+        for node in nodes:
+            parent = node.parent
+            if isinstance(parent, NotebookNode):
+                if parent.getGuid() != note.notebookGuid:
+                    self.removeNode(node)
+                    continue
+            elif isinstance(parent, TagNode):
+                if parent.getGuid() not in (note.tagGuids or []):
+                    self.removeNode(node)
+                    continue
+            parents.append(parent)
+
+        # Notebooks list the most recently updated notes first.
+        notebook = getNodeByInstance(note.notebookGuid, 0)
+        if isinstance(notebook, NotebookNode) and notebook.loaded:
+            if notebook not in parents:
+                notebook.addNote(note, 0)
+
+        for tagGuid in (note.tagGuids or []):
+            tag = getNodeByInstance(tagGuid, 0)
+            if isinstance(tag, TagNode) and tag.loaded:
+                if tag not in parents:
+                    tag.addNote(note)
+                    tag.children.sort(key=lambda n: n.title)
+
+    def removeNode(self, node):
+        if node.parent is not None:
+            node.parent.removeChild(node)
+        else:
+            for nodes in (self.notebooks, self.tags, self.searchResults):
+                if node in nodes:
+                    nodes.remove(node)
+        unregisterNode(node)
+
+    #
+    # If the user specified which notebooks to load, return their GUIDs.
+    # Otherwise all notebooks are loaded and None is returned.
+    #
+    def getNotebookGuids(self):
+        if int(vim.eval('exists("g:GeeknoteNotebooks")')):
+            return vim.eval('g:GeeknoteNotebooks')
+        return None
+
+    # Apply the notebook filters specified by the user (if any).
+    def filterNotebooks(self, notebooks):
+        guids = self.getNotebookGuids()
+        if guids is not None:
+            return [n for n in notebooks if n.guid in guids]
+
+        if not int(vim.eval('exists("g:GeeknoteNotebookFilters")')):
+            return notebooks
+
+        regex = []
+        filters = vim.eval('g:GeeknoteNotebookFilters')
+        for filter in filters:
+            try:
+                r = re.compile(filter)
+                regex.append(r)
+            except:
+                pass
+
+        filtered = []
+        for notebook in notebooks:
+            for r in regex:
+                if r.search(notebook.name):
+                    filtered.append(notebook)
+                    break
+        return filtered
 
     # Render the navigation buffer in the navigation window..
+    @stats.measured('Explorer.render')
     def render(self):
         if self.buffer is None:
             return
@@ -636,34 +1369,58 @@ class Explorer(object):
         # Save the selected node before redrawing the explorer.
         self.selectedNode = self.getSelectedNode()
         if self.selectedNode is None:
-            notebook = GeeknoteGetDefaultNotebook()
+            try:
+                notebook = GeeknoteGetDefaultNotebook()
+            except OfflineError:
+                notebook = None
             self.selectNotebook(notebook)
 
         # 
         # Before overwriting the navigation window, look for any changes made
         # by the user. Do not synchronize them yet with the server, just make
-        # sure they are not lost.
+        # sure they are not lost. The lines we last rendered no longer match
+        # the buffer then, so compare the new content with the buffer itself.
         #
         if isBufferModified(self.buffer.number):
             self.applyChanges()
+            self.lines = self.buffer[:]
 
-        # Clear the navigation buffer to get rid of old content (if any).
-        del self.buffer[:]
+        if self.lines is None:
+            self.lines = self.buffer[:]
+
+        #
+        # Render with the widest name/title seen so far. If the widest one
+        # that is shown now has a different width, align everything again.
+        #
+        content, width = self.renderContent()
+        if self.maxWidth != width:
+            self.maxWidth = width
+            content, width = self.renderContent()
+
+        changed = self.setLines(0, len(self.lines), content)
+        self.finishRender(changed)
+
+        setActiveWindow(origWin)
+
+    def renderContent(self):
+        clearRows()
 
         # Prepare rendering attributes
         attribs = {}
-        attribs['keyCol'] = self.getMinWidth() + 1
+        attribs['keyCol']   = self.getMinWidth() + 1
+        attribs['maxWidth'] = 0
 
         # Create separator
         fmt = '{:=^%d}' % (attribs['keyCol'] + 41)
         sep = fmt.format('=')
 
-        # Prepare the new content and append it to the navigation buffer.
+        # Prepare the new content of the navigation buffer.
         content = []
         content.append('Notebooks:')
         content.append(sep)
 
         # Render notebooks, notes, tags, and search results
+        attribs['firstRow'] = 1
         for node in self.notebooks:
             node.render(content, attribs)
 
@@ -675,7 +1432,8 @@ class Explorer(object):
             for node in self.tags:
                 node.render(content, attribs)
 
-        if len(self.searchResults) > 0:
+        self.moreRow = -1
+        if len(self.searchResults) > 0 or self.searchCursor is not None:
              content.append('')
              content.append('Search Results:')
              content.append(sep)
@@ -683,28 +1441,131 @@ class Explorer(object):
              for node in self.searchResults:
                  node.render(content, attribs)
 
-        # Write the content list to the buffer starting at row zero.
-        self.buffer.append(content, 0)
+             if self.searchPending is not None:
+                 renderLoading(content, 0)
+             elif self.searchCursor is not None and \
+                  self.searchCursor.hasMore():
+                 content.append(ExplorerTextMore.encode('utf8'))
+                 self.moreRow = len(content)
+
+        self.keyCol = attribs['keyCol']
+        return content, attribs['maxWidth']
+
+    #
+    # Render only the notebook/tag that the given node is shown under (or the
+    # node itself if it is a search result) and replace the lines it was shown
+    # on. Everything else stays as is. Used when a single node changes (it was
+    # expanded, collapsed, or its notes arrived).
+    #
+    def renderNode(self, node):
+        if self.buffer is None:
+            return
+
+        while node.parent is not None:
+            node = node.parent
+
+        #
+        # Render everything when the user changed the buffer (see
+        # applyChanges()) or when the node is not shown yet.
+        #
+        if node.row == -1 or self.lines is None or \
+           isBufferModified(self.buffer.number):
+            self.render()
+            return
+
+        origWin = getActiveWindow()
+        setActiveBuffer(self.buffer)
+
+        self.selectedNode = self.getSelectedNode()
+
+        first    = node.row
+        last     = node.row + node.rowCount
+        rowCount = node.rowCount
+
+        # Take the rows of the node and of all nodes below it.
+        below = []
+        for row in xrange(first, len(self.lines) + 1):
+            rowNode = rowMap.pop(row, None)
+            parent  = parentMap.pop(row, None)
+            if rowNode is not None:
+                rowNode.row = -1
+            elif parent is None:
+                continue
+            if row >= last:
+                below.append((row, rowNode, parent))
+
+        attribs = {}
+        attribs['keyCol']   = self.keyCol
+        attribs['maxWidth'] = 0
+        attribs['firstRow'] = first
+
+        content = []
+        node.render(content, attribs)
+
+        # A wider name/title means that all lines must be aligned again.
+        if attribs['maxWidth'] > self.maxWidth:
+            setActiveWindow(origWin)
+            self.render()
+            return
+
+        shift = len(content) - rowCount
+        for row, rowNode, parent in below:
+            if rowNode is None:
+                setHiddenRow(row + shift, parent)
+            else:
+                setNodeRow(rowNode, row + shift, parent)
+        if self.moreRow != -1:
+            self.moreRow += shift
+
+        changed = self.setLines(first - 1, last - 1, content)
+        self.finishRender(changed)
+
+        setActiveWindow(origWin)
+
+    #
+    # Replace the given range of lines (zero-based, end excluded) with the
+    # given content. Only the lines that actually differ are touched. Returns
+    # False if the buffer did not change at all.
+    #
+    def setLines(self, first, last, content):
+        old = self.lines[first:last]
+        num = min(len(old), len(content))
+
+        head = 0
+        while head < num and old[head] == content[head]:
+            head += 1
+
+        tail = 0
+        while tail < num - head and old[-tail - 1] == content[-tail - 1]:
+            tail += 1
 
+        if head == len(old) and head == len(content):
+            return False
+
+        lines = content[head:len(content) - tail]
+        self.buffer[first + head:last - tail] = lines
+        self.lines[first + head:last - tail] = lines
+        return True
+
+    def finishRender(self, changed):
         # Move the cursor over the selected node (if any)
-        if self.selectedNode is not None:
+        if changed and self.selectedNode is not None:
             if self.selectedNode.row != -1:
                 vim.current.window.cursor = (self.selectedNode.row, 0)
 
-        # Resize the window as appropriate.
-        self.resize()
+        # Resize the window if the width it needs changed.
+        width = self.getMinWidth()
+        if self.width != width:
+            self.width = width
+            self.resize()
 
         #
-        # Write the navigation window but disable BufWritePre events before
-        # doing so. We only want to check for user changes when the user was
-        # the one that saved the buffer.
+        # The buffer is never written anywhere. It is only marked as unmodified
+        # so that changes made by the user can be told apart from ours (see
+        # applyChanges()). Once rendered, the buffer holds nothing but ours.
         #
-        ei = vim.eval('&ei')
-        vim.command('set ei=BufWritePre')
-        vim.command("write!")
-        vim.command('set ei={}'.format(ei))
-
-        setActiveWindow(origWin)
+        if isBufferModified(self.buffer.number):
+            setBufferVariable(self.buffer.number, 'modified', False)
 
     def resize(self):
         # Fix the width if requested.
@@ -727,14 +1588,46 @@ class Explorer(object):
         vim.command("vertical resize %d" % width)
 
     def restoreExpandState(self):
+        expanded = []
         for key in self.expandState:
             node = getNode(key)
             if node is not None:
                 if self.expandState[key]:
-                    node.expand()
+                    expanded.append(node)
                 else:
                     node.close()
 
+        self.prefetch(expanded)
+        for node in expanded:
+            node.expand()
+
+    #
+    # Load the notes of all given nodes at the same time rather than one node
+    # after the other. At most one request per note store connection is in
+    # flight at any time, and requests the user is waiting on (e.g. opening a
+    # note) go first. If the results can be delivered in the background, the
+    # explorer is rendered once they all arrived. Otherwise, wait for them
+    # here.
+    #
+    def prefetch(self, nodes):
+        futures = []
+        for node in nodes:
+            node.load(prefetchPool, PriorityBackground)
+            if node.isLoading():
+                futures.append(node.getPending())
+
+        if len(futures) == 0:
+            return
+
+        if worker.isAvailable():
+            worker.gather(futures).then(self.onNodeLoaded)
+        else:
+            for future in futures:
+                try:
+                    future.wait()
+                except Exception:
+                    pass
+
     def saveExpandState(self):
         for node in self.notebooks:
             self.expandState[node.getKey()] = node.expanded
@@ -753,6 +1646,10 @@ class Explorer(object):
             setActiveWindow(origWin)
 
     def selectNotebook(self, notebook):
+        # Offline, the default notebook is unknown until it was stored.
+        if notebook is None:
+            return
+
         #
         # Notebooks never have more than one assoicated node, therefore, use
         # zero for the instance number.
@@ -768,8 +1665,15 @@ class Explorer(object):
 
     # Switch to the navigation buffer in the currently active window.
     def show(self):
-        vim.command('topleft 50 vsplit {}'.format(self.dataFile.name))
-        self.buffer = vim.current.buffer
+        if self.buffer is None:
+            vim.command('topleft 50 vnew')
+            vim.command('silent file __GeeknoteExplorer__')
+            self.buffer = vim.current.buffer
+            self.initBuffer()
+        else:
+            vim.command('topleft vertical 50 sbuffer {}'.format(
+                self.buffer.number))
+        self.width = None
 
         self.initView()
         self.render()
@@ -778,13 +1682,3 @@ class Explorer(object):
             ":call Vim_GeeknoteActivateNode()<cr>")
 
         self.hidden = False
-
-    def updateNodeLineNumbers(self):
-        for key in registry:
-            getNode(key).row = -1
-
-        for row in xrange(len(self.buffer)):
-            line = self.buffer[row]
-            key  = self.getNodeKey(line)
-            if key is not None:
-                getNode(key).row = row
@@ -0,0 +1,362 @@
+import vim
+import copy
+import time
+import uuid
+import hashlib
+
+from conn import *
+
+import worker
+
+# Notes created while offline have a local GUID until they are uploaded.
+LocalGuidPrefix = 'local-'
+
+def newLocalGuid():
+    return LocalGuidPrefix + str(uuid.uuid4())
+
+def isLocalGuid(guid):
+    return guid is not None and guid.startswith(LocalGuidPrefix)
+
+#======================== QueuedSave =========================================#
+
+#
+# A note/notebook waiting to be uploaded along with the outcome of past
+# attempts. 'kind' tells how it is uploaded:
+#
+#   note     - the note is updated (its content only if 'withContent' is set)
+#   create   - the note was created offline and is created on the server
+#   notebook - the notebook is updated
+#
+class QueuedSave(object):
+    def __init__(self, kind, obj, withContent):
+        self.kind        = kind
+        self.obj         = obj
+        self.withContent = withContent
+        self.serial      = 0
+        self.attempts    = 0
+        self.nextAttempt = 0
+        self.error       = None
+        self.status      = 'queued'
+        self.replay      = False
+        self.result      = None
+        self.conflict    = None
+
+    def describe(self):
+        if self.kind == 'notebook':
+            return 'notebook "{}"'.format(self.obj.name)
+        return 'note "{}"'.format(self.obj.title)
+
+    def isDue(self):
+        return self.nextAttempt <= time.time()
+
+#======================== SaveQueue ==========================================#
+
+#
+# Notes that were saved by the user but not uploaded yet. Saving only queues
+# the note, the upload happens in the background. A note that is saved again
+# before it was uploaded is only uploaded once (with its latest title and
+# content). Failed uploads are retried later, waiting twice as long after each
+# failure.
+#
+# The queue is kept in the metadata store (if enabled) so that saves that did
+# not make it to the server are uploaded once Vim is started again. It also
+# serves as the journal of offline mode: notes created and saved, as well as
+# notes/notebooks renamed or moved in the navigation window while offline,
+# are queued and replayed once back online (see flush()).
+#
+# A replayed note may have been changed on the server in the meantime. Its
+# update sequence number tells: if it is not the one the saved note was based
+# on and the content differs, the saved note is uploaded as a conflicting copy
+# instead of overwriting what is on the server. Later saves of that note are
+# still based on what it was based on, so they are checked as well.
+#
+# Every change in the status of a queued save is reported to the listeners,
+# along with a short description of the status (see GeeknoteShowSaveStatus
+# in view.py).
+#
+class SaveQueue(object):
+    # Seconds to wait before retrying a failed upload, doubled every failure.
+    RETRY_DELAY     = 5
+    MAX_RETRY_DELAY = 600
+
+    def __init__(self, store):
+        self.store     = store
+        self.saves     = {}
+        self.uploading = {}
+        self.conflicts = set()
+        self.serial    = 0
+        self.listeners = []
+
+        if store is not None:
+            for row in store.getQueuedSaves():
+                serial, kind, withContent, attempts, nextAttempt, error, obj = \
+                    row
+
+                save = QueuedSave(kind, obj, bool(withContent))
+                save.serial      = serial
+                save.attempts    = attempts
+                save.nextAttempt = nextAttempt
+                save.error       = error
+                save.replay      = True
+                self.saves[obj.guid] = save
+                self.serial = max(self.serial, serial)
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    #
+    # Queue the given note for upload. Only its title and notebook are sent
+    # unless 'withContent' is set (or an earlier save of the note that is
+    # still queued had it set).
+    #
+    def add(self, note, withContent):
+        queued = self.saves.get(note.guid)
+
+        #
+        # Keep the queued content (and what it was based on) when only the
+        # title/notebook changed since, e.g. the note was renamed in the
+        # navigation window. The queued note may be being uploaded, so it is
+        # copied rather than changed.
+        #
+        if queued is not None and queued.withContent and not withContent:
+            title, notebookGuid = note.title, note.notebookGuid
+            note = copy.copy(queued.obj)
+            note.title        = title
+            note.notebookGuid = notebookGuid
+            withContent = True
+        else:
+            note = copy.copy(note)
+
+        kind = 'create' if isLocalGuid(note.guid) else 'note'
+        self.queue(QueuedSave(kind, note, withContent), queued)
+
+    def addNotebook(self, notebook):
+        queued = self.saves.get(notebook.guid)
+        self.queue(QueuedSave('notebook', copy.copy(notebook), False), queued)
+
+    #
+    # Queue a note that was created while offline. It is given a local GUID
+    # (and stored so that it is listed in its notebook) until it is uploaded.
+    #
+    def create(self, note):
+        note.guid = newLocalGuid()
+        if self.store is not None:
+            self.store.putNotes([note])
+
+        self.add(note, True)
+        return note
+
+    def queue(self, save, queued):
+        self.serial += 1
+        save.serial = self.serial
+
+        # Saving again retries right away, but a failure still backs off.
+        if queued is not None:
+            save.attempts = queued.attempts
+            save.replay   = queued.replay
+        if GeeknoteIsOffline() or save.obj.guid in self.conflicts:
+            save.replay = True
+
+        self.saves[save.obj.guid] = save
+        self.persist(save)
+
+        if GeeknoteIsOffline():
+            self.notify(save, 'queued (offline)')
+        else:
+            self.notify(save, 'queued')
+        self.process()
+
+    # Return the note as it was last queued (None if it is not queued).
+    def getNote(self, guid):
+        save = self.saves.get(guid)
+        if save is None or save.kind == 'notebook':
+            return None
+        return copy.copy(save.obj)
+
+    def isQueued(self, guid):
+        return guid in self.saves
+
+    def getSaves(self):
+        return sorted(self.saves.values(), key=lambda s: s.serial)
+
+    #
+    # Upload every queued note that is due. Notes that are being uploaded
+    # already are uploaded again once that upload is done. Nothing is
+    # uploaded while offline.
+    #
+    def process(self):
+        if GeeknoteIsOffline():
+            return
+
+        for save in self.getSaves():
+            guid = save.obj.guid
+            if guid in self.uploading or not save.isDue():
+                continue
+
+            self.uploading[guid] = save
+            self.notify(save, 'saving')
+
+            future = worker.submit(uploadSave, save)
+            future.then(
+                lambda result, save=save: self.onSaved(save, result),
+                lambda e, save=save: self.onFailed(save, e))
+
+    # Upload everything that is queued now (e.g. once back online).
+    def flush(self):
+        for save in self.saves.values():
+            save.nextAttempt = 0
+        self.process()
+
+    def onSaved(self, save, result):
+        guid = save.obj.guid
+        del self.uploading[guid]
+
+        queued = self.saves.get(guid)
+        if queued is save:
+            del self.saves[guid]
+            if self.store is not None:
+                self.store.deleteQueuedSave(guid, save.serial)
+        elif queued is not None and save.conflict is not None:
+            queued.replay = True
+        elif queued is not None:
+            self.rebase(queued, result)
+
+        save.result = result
+        if save.conflict is not None:
+            self.conflicts.add(guid)
+            self.notify(save, 'conflict, saved as note "{}"'.format(
+                save.conflict.title))
+        else:
+            self.conflicts.discard(guid)
+            self.notify(save, 'saved')
+        self.process()
+
+    #
+    # The note was saved again while an earlier save of it was uploaded. The
+    # later save is based on what the server now has: a note that was just
+    # created is updated instead, with the GUID the server assigned.
+    #
+    def rebase(self, save, result):
+        if save.kind == 'notebook':
+            return
+
+        if save.kind == 'create':
+            del self.saves[save.obj.guid]
+            if self.store is not None:
+                self.store.deleteQueuedSave(save.obj.guid, save.serial)
+
+            save.kind     = 'note'
+            save.obj.guid = result.guid
+            self.saves[result.guid] = save
+
+        save.obj.updateSequenceNum = result.updateSequenceNum
+        save.obj.contentHash       = result.contentHash
+        self.persist(save)
+
+    def onFailed(self, save, e):
+        guid = save.obj.guid
+        del self.uploading[guid]
+
+        if self.saves.get(guid) is not save:
+            self.process()
+            return
+
+        # Went offline meanwhile, the save is replayed once back online.
+        if isinstance(e, OfflineError):
+            save.replay = True
+            self.notify(save, 'queued (offline)')
+            return
+
+        delay = min(self.RETRY_DELAY * 2 ** save.attempts,
+                    self.MAX_RETRY_DELAY)
+
+        # Do not retry before the server's rate limit is lifted.
+        if isinstance(e, RateLimitError):
+            delay = max(delay, e.seconds)
+
+        save.attempts   += 1
+        save.nextAttempt = time.time() + delay
+        save.error       = str(e)
+        save.replay      = True
+        self.persist(save)
+
+        self.notify(save, 'failed ({}), retrying in {}s'.format(
+            save.error, delay))
+        scheduleRetry(delay)
+        self.process()
+
+    def notify(self, save, status):
+        save.status = status
+        for listener in self.listeners:
+            listener(save, status)
+
+    def persist(self, save):
+        if self.store is not None:
+            self.store.putQueuedSave(
+                save.serial, save.kind, save.withContent, save.attempts,
+                save.nextAttempt, save.error, save.obj)
+
+#
+# Upload a queued note/notebook (runs on a worker thread). Returns the note as
+# it now is on the server (the notebook for notebooks).
+#
+def uploadSave(save):
+    if save.kind == 'notebook':
+        GeeknoteUpdateNotebook(save.obj)
+        return save.obj
+
+    if save.kind == 'create':
+        note = copy.copy(save.obj)
+        note.guid = None
+
+        note = GeeknoteCreateNewNote(note)
+        if metadataStore is not None:
+            metadataStore.deleteNotes([save.obj.guid])
+        return note
+
+    if save.withContent and save.replay:
+        server = GeeknoteRefreshNoteMeta(save.obj)
+        if isConflict(save.obj, server):
+            save.conflict = uploadConflictingCopy(save.obj)
+            return server
+
+    if save.withContent:
+        return GeeknoteUpdateNote(save.obj)
+    return GeeknoteUpdateNoteMeta(save.obj)
+
+#
+# Was the content of the note changed on the server since the given copy of
+# the note was downloaded (or last uploaded)? Not if the server already has
+# the very same content, e.g. an upload that timed out but went through.
+#
+def isConflict(note, server):
+    if note.updateSequenceNum is None:
+        return False
+    if server.updateSequenceNum == note.updateSequenceNum:
+        return False
+    if not isNoteActive(server):
+        return True
+    if server.contentHash == hashlib.md5(note.content).digest():
+        return False
+    return server.contentHash != note.contentHash
+
+# Save the note as a new note next to the one it conflicts with.
+def uploadConflictingCopy(note):
+    conflict              = Types.Note()
+    conflict.title        = note.title + ' (conflicting copy)'
+    conflict.content      = note.content
+    conflict.notebookGuid = note.notebookGuid
+    return GeeknoteCreateNewNote(conflict)
+
+#
+# Look for uploads to retry after the given number of seconds. Without timers,
+# failed uploads are retried the next time a note is saved.
+#
+def scheduleRetry(delay):
+    if worker.isAvailable():
+        vim.eval("timer_start({}, 'Vim_GeeknoteProcessSaves')".format(
+            int(delay * 1000)))
+
+#======================== Globals ============================================#
+
+saveQueue = SaveQueue(metadataStore)
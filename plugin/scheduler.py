@@ -0,0 +1,142 @@
+import time
+import heapq
+import threading
+import contextlib
+
+#======================== Priorities =========================================#
+
+#
+# Requests waiting to be made are made in order of priority (lowest first),
+# then in the order they were made. Requests the user is waiting on (opening
+# or saving a note, expanding a notebook) go before the ones made in the
+# background (prefetching notes, synchronizing the account).
+#
+PriorityInteractive = 0
+PriorityBackground  = 1
+
+# The priority of the requests made by each thread.
+local = threading.local()
+
+def getRequestPriority():
+    return getattr(local, 'priority', PriorityInteractive)
+
+@contextlib.contextmanager
+def requestPriority(priority):
+    previous = getRequestPriority()
+    local.priority = priority
+    try:
+        yield
+    finally:
+        local.priority = previous
+
+#
+# Call the function with the requests it makes given the priority. Meant to be
+# submitted to the workers, e.g. submit(callWithPriority, priority, func).
+#
+def callWithPriority(priority, func, *args):
+    with requestPriority(priority):
+        return func(*args)
+
+#======================== RequestScheduler ===================================#
+
+#
+# Raised instead of making a request when the server asked to wait for longer
+# than requests are willing to wait (see RequestScheduler.acquire()).
+#
+class RateLimitError(Exception):
+    def __init__(self, seconds):
+        self.seconds = int(seconds + 0.5)
+        super(RateLimitError, self).__init__(
+            'rate limit reached, retry in {}s'.format(self.seconds))
+
+#
+# Decides when each request to the server is made. A request is made once
+#
+#   - fewer than 'size' requests are in flight (one per connection),
+#   - the token bucket allows it: 'rate' requests are allowed per second on
+#     average, and up to that many at once after some time without requests
+#     (a rate of zero does not limit requests),
+#   - the server is not being waited on after it reported that its rate limit
+#     was reached (see pause()),
+#   - no request of a higher priority (or of the same priority but made
+#     earlier) is waiting.
+#
+# Requests are made by the threads that call acquire(), which blocks until the
+# request may be made. May be used from any thread.
+#
+class RequestScheduler(object):
+    def __init__(self, rate, size):
+        self.rate     = max(rate, 0)
+        self.capacity = max(rate, 1)
+        self.size     = max(size, 1)
+        self.tokens   = self.capacity
+        self.updated  = time.time()
+        self.running  = 0
+        self.resumeAt = 0
+        self.waiting  = []
+        self.serial   = 0
+        self.cond     = threading.Condition()
+
+    #
+    # Wait for the turn of a request of the given priority. Raises
+    # RateLimitError if the server must be waited on for more than 'maxWait'
+    # seconds. Call release() once the request is done.
+    #
+    def acquire(self, priority, maxWait):
+        with self.cond:
+            self.serial += 1
+            ticket = (priority, self.serial)
+            heapq.heappush(self.waiting, ticket)
+
+            try:
+                while True:
+                    delay = self.getDelay(ticket)
+                    if delay == 0:
+                        break
+
+                    remaining = self.resumeAt - time.time()
+                    if remaining > maxWait:
+                        raise RateLimitError(remaining)
+                    self.cond.wait(delay)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+
+            self.tokens  -= 1
+            self.running += 1
+
+    def release(self):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+    #
+    # The server reported that its rate limit was reached: make no request for
+    # the given number of seconds.
+    #
+    def pause(self, seconds):
+        with self.cond:
+            self.resumeAt = max(self.resumeAt, time.time() + seconds)
+            self.tokens   = 0
+            self.cond.notify_all()
+
+    #
+    # Return how long the request must wait before it may be made: zero if it
+    # may be made now, None if it must wait for another request (to be made
+    # or to be done).
+    #
+    def getDelay(self, ticket):
+        now = time.time()
+        if self.rate > 0:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                              self.capacity)
+        self.updated = now
+
+        if self.waiting[0] != ticket or self.running >= self.size:
+            return None
+        if now < self.resumeAt:
+            return self.resumeAt - now
+        if self.rate > 0 and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
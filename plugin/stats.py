@@ -0,0 +1,158 @@
+import vim
+import json
+import time
+import threading
+import functools
+import contextlib
+import collections
+
+#======================== Stat ===============================================#
+
+#
+# What was measured of one kind of operation: how often it ran (and failed),
+# how long it took and, for operations that talk to the server, how many bytes
+# were sent and received. Percentiles are computed from the latest
+# MAX_SAMPLES durations.
+#
+class Stat(object):
+    MAX_SAMPLES = 1000
+
+    def __init__(self, name):
+        self.name     = name
+        self.count    = 0
+        self.errors   = 0
+        self.seconds  = 0.0
+        self.samples  = collections.deque(maxlen=self.MAX_SAMPLES)
+        self.sent     = 0
+        self.received = 0
+        self.hits     = 0
+        self.misses   = 0
+
+    def add(self, seconds, failed):
+        self.count   += 1
+        self.seconds += seconds
+        self.samples.append(seconds)
+        if failed:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[int(round(fraction * (len(samples) - 1)))]
+
+#======================== Measuring ==========================================#
+
+allStats = {}
+lock     = threading.Lock()
+
+# The measurements in progress on each thread (see addBytes()).
+local = threading.local()
+
+def getStat(name):
+    stat = allStats.get(name)
+    if stat is None:
+        stat = allStats[name] = Stat(name)
+    return stat
+
+#
+# Measure how long the enclosed code takes. Measurements may be nested, e.g. a
+# note store call contains the HTTP requests it makes.
+#
+@contextlib.contextmanager
+def measure(name):
+    active = getattr(local, 'active', None)
+    if active is None:
+        active = local.active = []
+
+    entry = {'sent': 0, 'received': 0}
+    active.append(entry)
+
+    start  = time.time()
+    failed = False
+    try:
+        yield
+    except:
+        failed = True
+        raise
+    finally:
+        seconds = time.time() - start
+        active.pop()
+
+        with lock:
+            stat = getStat(name)
+            stat.add(seconds, failed)
+            stat.sent     += entry['sent']
+            stat.received += entry['received']
+
+        trace(name, start=start, ms=round(seconds * 1000, 3), failed=failed,
+              sent=entry['sent'], received=entry['received'])
+
+# Decorate a function so that every call of it is measured.
+def measured(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+#
+# Count bytes sent to and received from the server, adding them to every
+# measurement in progress on the calling thread.
+#
+def addBytes(sent, received):
+    for entry in getattr(local, 'active', []):
+        entry['sent']     += sent
+        entry['received'] += received
+
+# Count a lookup of the named cache.
+def countLookup(name, hit):
+    with lock:
+        stat = getStat(name)
+        if hit:
+            stat.hits += 1
+        else:
+            stat.misses += 1
+
+    trace(name, hit=hit)
+
+def getStats():
+    with lock:
+        return sorted(allStats.values(), key=lambda s: s.name)
+
+def resetStats():
+    with lock:
+        allStats.clear()
+
+#======================== Trace ==============================================#
+
+#
+# If g:GeeknoteTraceFile is set, every measurement and cache lookup is also
+# appended to that file as a line of JSON.
+#
+traceLock = threading.Lock()
+
+def openTraceFile():
+    if not int(vim.eval('exists("g:GeeknoteTraceFile")')):
+        return None
+    try:
+        return open(vim.eval('g:GeeknoteTraceFile'), 'a')
+    except IOError:
+        return None
+
+def trace(name, **fields):
+    if traceFile is None:
+        return
+
+    fields['name']   = name
+    fields['thread'] = threading.current_thread().name
+    fields.setdefault('start', time.time())
+
+    line = json.dumps(fields, sort_keys=True)
+    with traceLock:
+        traceFile.write(line + '\n')
+        traceFile.flush()
+
+traceFile = openTraceFile()
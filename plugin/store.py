@@ -0,0 +1,534 @@
+import re
+import time
+import contextlib
+import sqlite3
+import threading
+import cPickle as pickle
+
+#======================== MetadataStore ======================================#
+
+#
+# An on-disk (SQLite) copy of the account's notebooks, tags, and note metadata.
+# The explorer renders straight from the store when it is opened and refreshes
+# the store from the server in the background, so a warm start does not have
+# to wait on the network.
+#
+# Objects are stored as pickled Evernote types alongside the few columns that
+# are needed for lookups. The store is shared with background threads so every
+# access is serialized with a lock.
+#
+# The store also keeps the title and text of notes in a full-text index so
+# that notes can be searched without asking the server (see searchNotes()).
+# Index rows have the id of their noteText row, which unlike an implicit rowid
+# is never renumbered (e.g. by VACUUM).
+#
+class MetadataStore(object):
+    SCHEMA_VERSION = 7
+
+    # Full-text index modules, in order of preference.
+    TEXT_INDEX_MODULES = ('fts5', 'fts4')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock  = threading.RLock()
+        self.depth = 0
+        self.db    = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+
+        self.createTables()
+        if self.getState('version') != self.SCHEMA_VERSION:
+            self.dropTables()
+            self.createTables()
+            self.setState('version', self.SCHEMA_VERSION)
+
+        self.textIndex = self.getTextIndexModule()
+
+    #
+    # Forget everything but the saves that were not uploaded yet (see
+    # savequeue.py). Those are the user's work and are never dropped.
+    #
+    def clear(self):
+        with self.transaction():
+            for table in ('notebooks', 'tags', 'notes', 'noteTags',
+                          'listings', 'state', 'noteText', 'noteContent',
+                          'convertedText'):
+                self.db.execute('DELETE FROM %s' % table)
+            if self.textIndex is not None:
+                self.db.execute('DELETE FROM noteSearch')
+        self.setState('version', self.SCHEMA_VERSION)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    #
+    # Run a block of statements as a single transaction. Blocks may be nested
+    # (e.g. setNotebookNotes() calls putNotes()). Only the outermost block
+    # commits, or rolls back if an exception is raised.
+    #
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.depth += 1
+            try:
+                if self.depth == 1:
+                    with self.db:
+                        yield
+                else:
+                    yield
+            finally:
+                self.depth -= 1
+
+    def createTables(self):
+        with self.transaction():
+            self.db.executescript('''
+                CREATE TABLE IF NOT EXISTS notebooks (
+                    guid TEXT PRIMARY KEY,
+                    data BLOB);
+
+                CREATE TABLE IF NOT EXISTS tags (
+                    guid TEXT PRIMARY KEY,
+                    data BLOB);
+
+                CREATE TABLE IF NOT EXISTS notes (
+                    guid         TEXT PRIMARY KEY,
+                    notebookGuid TEXT,
+                    updated      INTEGER,
+                    data         BLOB);
+
+                CREATE TABLE IF NOT EXISTS noteTags (
+                    noteGuid TEXT,
+                    tagGuid  TEXT);
+
+                CREATE TABLE IF NOT EXISTS listings (
+                    guid TEXT PRIMARY KEY);
+
+                CREATE TABLE IF NOT EXISTS state (
+                    key   TEXT PRIMARY KEY,
+                    value BLOB);
+
+                CREATE TABLE IF NOT EXISTS noteContent (
+                    guid     TEXT PRIMARY KEY,
+                    size     INTEGER,
+                    accessed REAL,
+                    data     BLOB);
+
+                CREATE TABLE IF NOT EXISTS convertedText (
+                    contentHash BLOB,
+                    format      TEXT,
+                    size        INTEGER,
+                    accessed    REAL,
+                    text        BLOB,
+                    PRIMARY KEY (contentHash, format));
+
+                CREATE TABLE IF NOT EXISTS noteText (
+                    id          INTEGER PRIMARY KEY,
+                    guid        TEXT UNIQUE,
+                    contentHash BLOB,
+                    title       TEXT,
+                    content     TEXT);
+
+                CREATE TABLE IF NOT EXISTS saveQueue (
+                    guid        TEXT PRIMARY KEY,
+                    serial      INTEGER,
+                    kind        TEXT,
+                    withContent INTEGER,
+                    attempts    INTEGER,
+                    nextAttempt REAL,
+                    error       TEXT,
+                    data        BLOB);
+
+                CREATE INDEX IF NOT EXISTS notesByNotebook
+                    ON notes (notebookGuid);
+                CREATE INDEX IF NOT EXISTS noteTagsByNote
+                    ON noteTags (noteGuid);
+                CREATE INDEX IF NOT EXISTS noteTagsByTag
+                    ON noteTags (tagGuid);
+            ''')
+
+            #
+            # Index the text with the best module that SQLite was built with.
+            # Without any, searches fall back to scanning the text.
+            #
+            for module in self.TEXT_INDEX_MODULES:
+                try:
+                    self.db.execute(
+                        'CREATE VIRTUAL TABLE IF NOT EXISTS noteSearch '
+                        'USING %s (title, content)' % module)
+                    break
+                except sqlite3.OperationalError:
+                    pass
+
+    def dropTables(self):
+        with self.transaction():
+            rows = self.db.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type='table'")
+            tables = rows.fetchall()
+
+            # Drop full-text indexes first, they own some of the other tables.
+            tables.sort(key=lambda t: 'VIRTUAL' not in (t[1] or ''))
+            for (name, sql) in tables:
+                self.db.execute('DROP TABLE IF EXISTS %s' % name)
+
+    def getTextIndexModule(self):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT sql FROM sqlite_master WHERE name='noteSearch'"
+                ).fetchone()
+        if row is None:
+            return None
+
+        sql = row[0].lower()
+        for module in self.TEXT_INDEX_MODULES:
+            if module in sql:
+                return module
+        return None
+
+    #
+    # The server lists all notebooks/tags at once, so set*() replaces whatever
+    # was stored before. Sync chunks only report what changed, see put*() and
+    # delete*().
+    #
+    def getNotebook(self, guid):
+        notebooks = self.loadObjects(
+            'SELECT data FROM notebooks WHERE guid = ?', (guid,))
+        return notebooks[0] if notebooks else None
+
+    def getNotebooks(self):
+        return self.loadObjects('SELECT data FROM notebooks')
+
+    def putNotebooks(self, notebooks):
+        with self.transaction():
+            for notebook in notebooks:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO notebooks VALUES (?, ?)',
+                    (notebook.guid, dumpObject(notebook)))
+
+    def setNotebooks(self, notebooks):
+        with self.transaction():
+            self.db.execute('DELETE FROM notebooks')
+            self.putNotebooks(notebooks)
+
+    def deleteNotebooks(self, guids):
+        with self.transaction():
+            for guid in guids:
+                self.db.execute(
+                    'DELETE FROM notebooks WHERE guid = ?', (guid,))
+                self.db.execute(
+                    'DELETE FROM listings WHERE guid = ?', (guid,))
+
+    def getTags(self):
+        return self.loadObjects('SELECT data FROM tags')
+
+    def putTags(self, tags):
+        with self.transaction():
+            for tag in tags:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO tags VALUES (?, ?)',
+                    (tag.guid, dumpObject(tag)))
+
+    def setTags(self, tags):
+        with self.transaction():
+            self.db.execute('DELETE FROM tags')
+            self.putTags(tags)
+
+    def deleteTags(self, guids):
+        with self.transaction():
+            for guid in guids:
+                self.db.execute('DELETE FROM tags WHERE guid = ?', (guid,))
+                self.db.execute(
+                    'DELETE FROM noteTags WHERE tagGuid = ?', (guid,))
+                self.db.execute(
+                    'DELETE FROM listings WHERE guid = ?', (guid,))
+
+    #
+    # Note metadata. Notes are returned most recently updated first, which is
+    # the order the server uses when listing a notebook.
+    #
+    def getNotes(self, notebookGuid=None, tagGuid=None):
+        if notebookGuid is not None:
+            return self.loadObjects(
+                'SELECT data FROM notes WHERE notebookGuid = ? '
+                'ORDER BY updated DESC', (notebookGuid,))
+
+        if tagGuid is not None:
+            return self.loadObjects(
+                'SELECT notes.data FROM notes '
+                'JOIN noteTags ON noteTags.noteGuid = notes.guid '
+                'WHERE noteTags.tagGuid = ? '
+                'ORDER BY notes.updated DESC', (tagGuid,))
+
+        return self.loadObjects('SELECT data FROM notes ORDER BY updated DESC')
+
+    def deleteNotes(self, guids):
+        with self.transaction():
+            for guid in guids:
+                self.db.execute('DELETE FROM notes WHERE guid = ?', (guid,))
+                self.db.execute(
+                    'DELETE FROM noteTags WHERE noteGuid = ?', (guid,))
+                self.deleteNoteText(guid)
+
+    def putNotes(self, notes):
+        with self.transaction():
+            for note in notes:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?)',
+                    (note.guid, note.notebookGuid, note.updated,
+                     dumpObject(note)))
+
+                self.db.execute(
+                    'DELETE FROM noteTags WHERE noteGuid = ?', (note.guid,))
+                for tagGuid in (note.tagGuids or []):
+                    self.db.execute(
+                        'INSERT INTO noteTags VALUES (?, ?)',
+                        (note.guid, tagGuid))
+
+                self.putNoteTitle(note)
+
+    # Replace all notes with the given ones.
+    def setAllNotes(self, notes):
+        with self.transaction():
+            self.db.execute('DELETE FROM noteTags')
+            self.db.execute('DELETE FROM notes')
+            self.putNotes(notes)
+
+    # Replace the list of notes contained in the given notebook.
+    def setNotebookNotes(self, notebookGuid, notes):
+        with self.transaction():
+            self.db.execute(
+                'DELETE FROM noteTags WHERE noteGuid IN '
+                '(SELECT guid FROM notes WHERE notebookGuid = ?)',
+                (notebookGuid,))
+            self.db.execute(
+                'DELETE FROM notes WHERE notebookGuid = ?', (notebookGuid,))
+            self.putNotes(notes)
+            self.addListing(notebookGuid)
+
+    # Replace the list of notes that have the given tag applied.
+    def setTagNotes(self, tagGuid, notes):
+        with self.transaction():
+            self.db.execute(
+                'DELETE FROM noteTags WHERE tagGuid = ?', (tagGuid,))
+            self.putNotes(notes)
+            self.addListing(tagGuid)
+
+    #
+    # Note text. Titles are indexed as soon as a note is listed but the text
+    # of its content only once the note was opened or saved (the server only
+    # sends note content on request). Text that no longer matches the note's
+    # content hash is dropped.
+    #
+    def putNoteText(self, guid, contentHash, title, content):
+        with self.transaction():
+            self.deleteNoteText(guid)
+            cursor = self.db.execute(
+                'INSERT INTO noteText (guid, contentHash, title, content) '
+                'VALUES (?, ?, ?, ?)',
+                (guid, toBlob(contentHash), title, content))
+            if self.textIndex is not None:
+                self.db.execute(
+                    'INSERT INTO noteSearch (rowid, title, content) '
+                    'VALUES (?, ?, ?)', (cursor.lastrowid, title, content))
+
+    def putNoteTitle(self, note):
+        with self.transaction():
+            row = self.db.execute(
+                'SELECT contentHash, title, content FROM noteText '
+                'WHERE guid = ?', (note.guid,)).fetchone()
+
+            # Note metadata from listings does not include the content hash.
+            newHash = getattr(note, 'contentHash', None)
+
+            contentHash, content = None, None
+            if row is not None:
+                contentHash, content = row[0], row[2]
+                if newHash is not None and toBlob(newHash) != contentHash:
+                    contentHash, content = None, None
+                elif row[1] == note.title:
+                    return
+
+            self.putNoteText(note.guid, contentHash, note.title, content)
+
+    def deleteNoteText(self, guid):
+        with self.transaction():
+            if self.textIndex is not None:
+                self.db.execute(
+                    'DELETE FROM noteSearch WHERE rowid = '
+                    '(SELECT id FROM noteText WHERE guid = ?)', (guid,))
+            self.db.execute('DELETE FROM noteText WHERE guid = ?', (guid,))
+
+    #
+    # Return the notes whose title or text contains all of the given words
+    # (or words that start with them), most recently updated first.
+    #
+    def searchNotes(self, words, limit):
+        words = re.findall(r'\w+', words.decode('utf8'), re.UNICODE)
+        if not words:
+            return []
+
+        if self.textIndex is not None:
+            # Lowercase words are never mistaken for query operators.
+            query = u' '.join(w.lower() + u'*' for w in words)
+            return self.loadObjects(
+                'SELECT notes.data FROM noteSearch '
+                'JOIN noteText ON noteText.id = noteSearch.rowid '
+                'JOIN notes ON notes.guid = noteText.guid '
+                'WHERE noteSearch MATCH ? '
+                'ORDER BY notes.updated DESC LIMIT ?', (query, limit))
+
+        clauses = []
+        args    = []
+        for word in words:
+            pattern = u'%' + word + u'%'
+            clauses.append('(noteText.title LIKE ? OR noteText.content LIKE ?)')
+            args += [pattern, pattern]
+
+        return self.loadObjects(
+            'SELECT notes.data FROM noteText '
+            'JOIN notes ON notes.guid = noteText.guid '
+            'WHERE ' + ' AND '.join(clauses) + ' '
+            'ORDER BY notes.updated DESC LIMIT ?', args + [limit])
+
+    #
+    # Notes along with their content, see ContentCache in cache.py. The least
+    # recently accessed notes are dropped first when trimming.
+    #
+    def getNoteContent(self, guid):
+        with self.transaction():
+            self.db.execute(
+                'UPDATE noteContent SET accessed = ? WHERE guid = ?',
+                (time.time(), guid))
+            notes = self.loadObjects(
+                'SELECT data FROM noteContent WHERE guid = ?', (guid,))
+        return notes[0] if notes else None
+
+    def putNoteContent(self, note):
+        with self.transaction():
+            self.db.execute(
+                'INSERT OR REPLACE INTO noteContent VALUES (?, ?, ?, ?)',
+                (note.guid, len(note.content), time.time(), dumpObject(note)))
+
+    def deleteNoteContent(self, guids):
+        with self.transaction():
+            for guid in guids:
+                self.db.execute(
+                    'DELETE FROM noteContent WHERE guid = ?', (guid,))
+
+    def trimNoteContent(self, maxBytes):
+        self.trimTable('noteContent', maxBytes)
+
+    #
+    # Text that note content was converted to, see TextCache in cache.py.
+    #
+    def getConvertedText(self, contentHash, format):
+        key = (sqlite3.Binary(contentHash), format)
+        with self.transaction():
+            self.db.execute(
+                'UPDATE convertedText SET accessed = ? '
+                'WHERE contentHash = ? AND format = ?', (time.time(),) + key)
+            row = self.db.execute(
+                'SELECT text FROM convertedText '
+                'WHERE contentHash = ? AND format = ?', key).fetchone()
+        return str(row[0]) if row is not None else None
+
+    def putConvertedText(self, contentHash, format, text):
+        with self.transaction():
+            self.db.execute(
+                'INSERT OR REPLACE INTO convertedText VALUES (?, ?, ?, ?, ?)',
+                (sqlite3.Binary(contentHash), format, len(text), time.time(),
+                 sqlite3.Binary(text)))
+
+    def trimConvertedText(self, maxBytes):
+        self.trimTable('convertedText', maxBytes)
+
+    # Drop the least recently accessed rows until 'maxBytes' are left.
+    def trimTable(self, table, maxBytes):
+        with self.transaction():
+            total = self.db.execute(
+                'SELECT TOTAL(size) FROM %s' % table).fetchone()[0]
+            if total <= maxBytes:
+                return
+
+            rows = self.db.execute(
+                'SELECT rowid, size FROM %s ORDER BY accessed' % table)
+            for (rowid, size) in rows.fetchall():
+                if total <= maxBytes:
+                    break
+                self.db.execute(
+                    'DELETE FROM %s WHERE rowid = ?' % table, (rowid,))
+                total -= size
+
+    #
+    # Notes/notebooks waiting to be uploaded (see SaveQueue in savequeue.py).
+    # Unlike the rest of the store, these are not a copy of what is on the
+    # server. Each is returned as a (serial, kind, withContent, attempts,
+    # nextAttempt, error, object) tuple, oldest first.
+    #
+    def getQueuedSaves(self):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT serial, kind, withContent, attempts, nextAttempt, '
+                'error, data FROM saveQueue ORDER BY serial').fetchall()
+        return [row[:6] + (pickle.loads(str(row[6])),) for row in rows]
+
+    def putQueuedSave(self, serial, kind, withContent, attempts, nextAttempt,
+                      error, obj):
+        with self.transaction():
+            self.db.execute(
+                'INSERT OR REPLACE INTO saveQueue '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (obj.guid, serial, kind, int(withContent), attempts,
+                 nextAttempt, error, dumpObject(obj)))
+
+    # Delete the queued save unless it was replaced by a later one.
+    def deleteQueuedSave(self, guid, serial):
+        with self.transaction():
+            self.db.execute(
+                'DELETE FROM saveQueue WHERE guid = ? AND serial = ?',
+                (guid, serial))
+
+    #
+    # A listing is recorded for every notebook/tag whose notes were fetched in
+    # full. Only those notebooks/tags can be expanded from the store.
+    #
+    def addListing(self, guid):
+        with self.transaction():
+            self.db.execute(
+                'INSERT OR REPLACE INTO listings VALUES (?)', (guid,))
+
+    def clearListings(self):
+        with self.transaction():
+            self.db.execute('DELETE FROM listings')
+
+    def hasListing(self, guid):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT 1 FROM listings WHERE guid = ?', (guid,)).fetchone()
+        return row is not None
+
+    def getState(self, key, default=None):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(str(row[0]))
+
+    def setState(self, key, value):
+        with self.transaction():
+            self.db.execute(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                (key, dumpObject(value)))
+
+    def loadObjects(self, query, args=()):
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [pickle.loads(str(row[0])) for row in rows]
+
+def dumpObject(obj):
+    return sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+def toBlob(data):
+    if data is None:
+        return None
+    return sqlite3.Binary(data)
@@ -0,0 +1,135 @@
+import time
+import errno
+import socket
+import httplib
+import urlparse
+
+from cStringIO import StringIO
+
+from thrift.transport.TTransport import TTransportBase, TTransportException
+
+import stats
+
+#======================== KeepAliveHttpClient ================================#
+
+#
+# The server had closed the connection: the request could not be sent, or the
+# connection was closed without any answer. The server did not receive the
+# request or ignored it, so it is safe to send it again.
+#
+class ConnectionClosed(Exception):
+    pass
+
+#
+# A Thrift transport that sends each request as an HTTP POST, like Thrift's
+# THttpClient, but keeps the connection to the server open between requests.
+# THttpClient opens a new connection for every request, paying for a TCP and
+# TLS handshake each time.
+#
+# The server closes connections that stay idle for too long. Such a
+# connection is replaced before it is used again. If the server closed a
+# connection earlier than expected, a request sent over it cannot be sent or
+# gets no answer at all (see ConnectionClosed) and is sent once more over a
+# new connection. Requests that failed otherwise (e.g. timed out) are never
+# sent again, the server may have carried them out.
+#
+class KeepAliveHttpClient(TTransportBase):
+    # Seconds a connection may stay idle before it is replaced.
+    IDLE_TIMEOUT = 50
+
+    # Seconds to wait on the server before giving up on a request.
+    TIMEOUT = 60
+
+    def __init__(self, url):
+        parsed = urlparse.urlparse(url)
+
+        self.secure = parsed.scheme == 'https'
+        self.host   = parsed.hostname
+        self.port   = parsed.port
+        self.path   = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+
+        self.http     = None
+        self.lastUsed = 0
+        self.wbuf     = StringIO()
+        self.rbuf     = StringIO()
+
+    def isOpen(self):
+        return self.http is not None
+
+    def open(self):
+        if self.secure:
+            self.http = httplib.HTTPSConnection(
+                self.host, self.port, timeout=self.TIMEOUT)
+        else:
+            self.http = httplib.HTTPConnection(
+                self.host, self.port, timeout=self.TIMEOUT)
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+
+    def read(self, size):
+        return self.rbuf.read(size)
+
+    def write(self, data):
+        self.wbuf.write(data)
+
+    def flush(self):
+        data = self.wbuf.getvalue()
+        self.wbuf = StringIO()
+
+        if self.http is not None:
+            if time.time() - self.lastUsed > self.IDLE_TIMEOUT:
+                self.close()
+
+        reused = self.http is not None
+        try:
+            try:
+                body = self.post(data)
+            except ConnectionClosed:
+                # Only a connection used before can have been closed early.
+                if not reused:
+                    raise
+                self.close()
+                body = self.post(data)
+        except (ConnectionClosed, httplib.HTTPException, socket.error) as e:
+            self.close()
+            raise TTransportException(TTransportException.UNKNOWN, str(e))
+
+        self.rbuf = StringIO(body)
+
+    @stats.measured('http')
+    def post(self, data):
+        if self.http is None:
+            self.open()
+
+        try:
+            self.http.request('POST', self.path, data, {
+                'Content-Type' : 'application/x-thrift',
+                'User-Agent'   : 'vim-geeknote',
+            })
+        except socket.error as e:
+            if e.errno in (errno.ECONNRESET, errno.EPIPE):
+                raise ConnectionClosed(str(e))
+            raise
+
+        try:
+            response = self.http.getresponse()
+        except httplib.BadStatusLine as e:
+            raise ConnectionClosed('no answer ({!r})'.format(e.line))
+        body     = response.read()
+        self.lastUsed = time.time()
+        stats.addBytes(len(data), len(body))
+
+        if response.getheader('connection', '').lower() == 'close':
+            self.close()
+
+        if response.status != 200:
+            self.close()
+            raise TTransportException(
+                TTransportException.UNKNOWN,
+                'HTTP {} {}'.format(response.status, response.reason))
+        return body
@@ -1,15 +1,30 @@
 import vim
+import time
 import tempfile
-
-def createTempFile(**kwargs):
-    if 'prefix' not in kwargs:
-        kwargs['prefix'] = '__Geeknote__'
-
-    if 'dir' not in kwargs:
-        if int(vim.eval('exists("g:GeeknoteScratchDirectory")')):
-            kwargs['dir'] = vim.eval('g:GeeknoteScratchDirectory')
-
-    return tempfile.NamedTemporaryFile(**kwargs)
+import contextlib
+
+# Return the directory in which all scratch files should be maintained.
+def getScratchDirectory():
+    if int(vim.eval('exists("g:GeeknoteScratchDirectory")')):
+        return vim.eval('g:GeeknoteScratchDirectory')
+    return tempfile.gettempdir()
+
+#======================== Startup Time =======================================#
+
+#
+# How long each step of loading the plugin took, as (name, seconds) tuples in
+# the order the steps completed (see :GeeknoteStartupTime). Steps may contain
+# other steps, e.g. loading the modules includes opening the metadata store.
+#
+startupTimes = []
+
+@contextlib.contextmanager
+def startupPhase(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        startupTimes.append((name, time.time() - start))
 
 #======================== Vim Helper Functions  ==============================#
 
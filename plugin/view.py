@@ -1,12 +1,39 @@
 import vim
+import hashlib
 
-from enml  import *
-from utils import *
-from conn  import *
+from enml      import *
+from utils     import *
+from conn      import *
+from savequeue import saveQueue
 
-# Maps buffer names to NoteTracker objects.
+import stats
+import worker
+
+# Maps the GUIDs of opened notes to NoteTracker objects.
 openNotes = {}
 
+# Shown in place of a note's content while it is being loaded.
+NoteTextLoading = u'loading\u2026'.encode('utf8')
+
+#
+# Notes are shown in buffers named after them (the prefix followed by the
+# note's GUID). The buffers are not backed by any file: reading and writing
+# them loads and saves the note instead.
+#
+NoteBufferPrefix = 'geeknote://'
+
+autocmd('BufReadCmd',
+        NoteBufferPrefix + '*',
+        ':call Vim_GeeknoteReadNote(expand("<amatch>"))')
+
+autocmd('BufWriteCmd',
+        NoteBufferPrefix + '*',
+        ':call Vim_GeeknoteSaveNote(expand("<amatch>"))')
+
+autocmd('BufDelete',
+        NoteBufferPrefix + '*',
+        ':call Vim_GeeknoteCloseNote(expand("<amatch>"))')
+
 #
 # Holds all information that needs to be tracked for any note that has been
 # opened.
@@ -15,76 +42,156 @@ class NoteTracker(object):
     def __init__(self, note, buffer):
         self.note     = note
         self.buffer   = buffer
-        self.modified = False
+        self.loading  = False
+
+        #
+        # Hash of the text of the content as last shown in (or saved from) the
+        # buffer. Text is compared rather than ENML: content written by other
+        # clients does not encode back to the same ENML.
+        #
+        self.textHash        = None
+        self.contentModified = False
 
 # Close all opened notes.
 def GeeknoteCloseAllNotes():
-    #
-    # Try to delete any temp files that still exist (is is possible that 
-    # some/all were already garbage collected by the OS.
-    #
-    try:
-        for filename in openNotes:
-            os.remove(filename)
-    except:
-        pass
-
     openNotes.clear()
 
 # Close the note associated with the given buffer name.
-def GeeknoteCloseNote(filename):
-    if filename in openNotes:
-        os.remove(filename)
-        del openNotes[filename]
+def GeeknoteCloseNote(name):
+    openNotes.pop(GeeknoteGetNoteGuid(name), None)
 
 # Commit any changes that were made to the note in the buffer to the note.
 def GeeknoteCommitChangesToNote(note):
     tracker = GeeknoteGetNoteTracker(note)
 
     # If the note has not been modified, there's nothing more to do.
-    if tracker.modified is False:
+    buffer = tracker.buffer
+    if buffer.options['modified'] is False or tracker.loading:
         return False
 
     #
     # Now that we know the note has been modified, read the note's buffer and
-    # pull out the note's title and content.
-    #
-    content = ''
-    title   = tracker.note.title
-    lines   = open(tracker.buffer.name, 'r').readlines()
-    if len(lines) > 0:
-        title = lines.pop(0).strip()
-        while len(lines) > 0:
-            if lines[0].strip() == '':
-                lines.pop(0)
-            else:
-                break
-    for r in lines:
-        content += r
+    # pull out the note's title and content. The buffer now holds what is
+    # being saved.
+    #
+    title, content = GeeknoteGetBufferNote(buffer[:], tracker.note.title)
+    buffer.options['modified'] = False
+
+    #
+    # Compare the title and content with what is on the server. Saving the
+    # buffer without changing either does not require an update. Saved
+    # content is uploaded (or retried) no matter what, so it counts as saved
+    # from now on.
+    #
+    textHash = hashlib.md5(content).digest()
+    tracker.contentModified = textHash != tracker.textHash
+    if title == tracker.note.title and not tracker.contentModified:
+        return False
 
     # Update the note's title and content from what was read from the buffer.
-    tracker.note.title   = title
-    tracker.note.content = textToENML(content)
+    tracker.note.title = title
+    if tracker.contentModified:
+        tracker.note.content = textToENML(content)
+        tracker.textHash     = textHash
+
+    GeeknoteIndexNoteText(tracker.note, content)
 
     return True
  
+#
+# Split the lines of a note's buffer into the note's title (the first line)
+# and content (the remaining lines, less leading blank lines).
+#
+def GeeknoteGetBufferNote(lines, title=''):
+    if len(lines) == 0:
+        return title, ''
+
+    title = lines[0].strip()
+    start = 1
+    while start < len(lines) and lines[start].strip() == '':
+        start += 1
+
+    if start == len(lines):
+        return title, ''
+    return title, '\n'.join(lines[start:]) + '\n'
+
+# Return the name of the buffer that shows the given note.
+def GeeknoteGetNoteBufferName(note):
+    return NoteBufferPrefix + note.guid
+
+# Return the GUID of the note shown in the buffer with the given name.
+def GeeknoteGetNoteGuid(name):
+    if name.startswith(NoteBufferPrefix):
+        return name[len(NoteBufferPrefix):]
+    return None
+
 # Find the object that is tracking the given note (None if note opened).
 def GeeknoteGetNoteTracker(note):
-    for filename in openNotes:
-        if openNotes[filename].note.guid == note.guid:
-            return openNotes[filename]
-    return None
+    return openNotes.get(note.guid)
 
 # Given the name of a buffer, find the note that the buffer represents.
-def GeeknoteGetOpenNote(filename):
-    if filename in openNotes:
-        return openNotes[filename].note
+def GeeknoteGetOpenNote(name):
+    tracker = openNotes.get(GeeknoteGetNoteGuid(name))
+    if tracker is not None:
+        return tracker.note
     return None
 
 # Determine if the note has been modified since since it was last saved.
 def GeeknoteNoteIsModified(note):
     tracker = GeeknoteGetNoteTracker(note)
-    return tracker.modified
+    return tracker.buffer.options['modified']
+
+#
+# Show the upload status of a saved note (see SaveQueue) in the buffer
+# variable b:GeeknoteSaveStatus. Failures and conflicts are reported as
+# messages as well.
+#
+def GeeknoteShowSaveStatus(save, status):
+    if status.startswith('failed') or status.startswith('conflict'):
+        vim.command('echomsg "Geeknote: saving {} {}"'.format(
+            save.describe().replace('"', "'"), status.replace('"', "'")))
+
+    if save.kind == 'notebook':
+        return
+
+    tracker = GeeknoteGetNoteTracker(save.obj)
+    if tracker is None:
+        return
+
+    # After a conflict, the buffer is still based on what it was based on.
+    if save.result is not None and save.conflict is None:
+        GeeknoteSetNoteUploaded(tracker, save.result)
+
+    if tracker.buffer is not None and tracker.buffer.valid:
+        tracker.buffer.vars['GeeknoteSaveStatus'] = status
+
+saveQueue.addListener(GeeknoteShowSaveStatus)
+
+#
+# Record what the server has once an opened note was uploaded. Later saves
+# of the note are based on it (see isConflict() in savequeue.py). A note
+# that was created offline gets its GUID, and so its buffer name, only now.
+#
+def GeeknoteSetNoteUploaded(tracker, result):
+    note = tracker.note
+    note.updateSequenceNum = result.updateSequenceNum
+    note.contentHash       = result.contentHash
+
+    if note.guid != result.guid:
+        del openNotes[note.guid]
+        note.guid = result.guid
+        openNotes[note.guid] = tracker
+
+        if tracker.buffer is not None and tracker.buffer.valid:
+            tracker.buffer.name = GeeknoteGetNoteBufferName(note)
+
+#
+# Determine if the content of the note differs from the content on the server
+# (as of the last call to GeeknoteCommitChangesToNote).
+#
+def GeeknoteNoteContentIsModified(note):
+    tracker = GeeknoteGetNoteTracker(note)
+    return tracker.contentModified
 
 # Determine if the user has already opened the given note.
 def GeeknoteNoteIsOpened(note):
@@ -115,61 +222,41 @@ def GeeknoteOpenNote(note):
     #
     opened = GeeknoteNoteIsOpened(note)
     if opened is False:
-        # Load the note's content
-        note    = GeeknoteLoadNote(note)
-        content = ENMLtoText(note.content)
-        content = tools.stdoutEncode(content)
-
-        # Write the note's title and content to a temporary file.
-        f = createTempFile(delete=False)
-        f.write(note.title + '\n\n')
-        
-        isNoteEmpty = not content.strip()
-        if isNoteEmpty is False:
-            f.write(content)
-        else:
-            f.write("<add content here>\n")
-        f.flush()
-
-        # Now edit the file in a new buffer within the active window.
-        vim.command('edit {}'.format(f.name))
-
-        # Close the file now that it is open in the buffer.
-        f.close()
-
-        # Position the cursor at a convenient location if opening an empty note
-        if isNoteEmpty:
-            vim.current.window.cursor = (3, 0)
-
         #
         # Create an object to keep track of the note and all associated
         # information while it's opened.
         #
-        openNotes[f.name] = NoteTracker(note, vim.current.buffer)
+        tracker = NoteTracker(note, None)
+        tracker.loading = True
+        openNotes[note.guid] = tracker
 
-        # Register callbacks for the buffer events that affect the note.
-        autocmd('BufWritePre', 
-                '<buffer>',
-                ':call Vim_GeeknotePrepareToSaveNote("{}")'.format(f.name))
+        #
+        # Edit the note's buffer within the active window. It shows the note's
+        # title along with a placeholder for the content (see
+        # GeeknoteReadNote). The content is downloaded in the background and
+        # replaces the placeholder once it arrives.
+        #
+        name = GeeknoteGetNoteBufferName(note)
+        vim.command('edit {}'.format(name))
 
-        autocmd('BufWritePost',
-                '<buffer>',
-                ':call Vim_GeeknoteSaveNote("{}")'.format(f.name))
-     
-        autocmd('BufDelete',
-                '<buffer>',
-                ':call Vim_GeeknoteCloseNote("{}")'.format(f.name))
+        # The buffer was loaded already (Vim did not read it), fill it now.
+        if tracker.buffer is None:
+            GeeknoteReadNote(name)
 
         vim.command("let b:GeeknoteTitle=\"%s\"" % note.title)
-        notebook = GeeknoteGetNotebook(note.notebookGuid)
-        vim.command("let b:GeeknoteNotebook=\"%s\"" % notebook.name)
+
+        queued = saveQueue.getNote(note.guid)
+        future = worker.submit(GeeknoteFetchNote, note, queued)
+        future.then(
+            lambda result: GeeknoteShowNoteContent(tracker, *result),
+            lambda e: GeeknoteHandleNoteLoadFailure(tracker, e))
     #
     # Otherwise, the note has aleady been opened. Simply switch the active window
     # to the note's buffer.
     #
     else:
         tracker = GeeknoteGetNoteTracker(note)
-        vim.command("buffer {}".format(tracker.buffer.name))
+        vim.command("buffer {}".format(tracker.buffer.number))
 
     #
     # By default, Geeknote expects to receive notes with markdown-formated
@@ -184,10 +271,123 @@ def GeeknoteOpenNote(note):
     # Now restore the original window.
     setActiveWindow(origWin)
 
-def GeeknotePrepareToSaveNote(filename):
-    filename = os.path.abspath(filename)
-    tracker  = openNotes[filename]
-    tracker.modified = tracker.buffer.options['modified']
+#
+# Download the content of the given note along with its notebook. If the note
+# was saved but not uploaded yet, what was saved is shown instead. Vim is not
+# used, so this may run on a background thread.
+#
+def GeeknoteFetchNote(note, queued=None):
+    if queued is not None and queued.content is not None:
+        note = queued
+    else:
+        note = GeeknoteLoadNote(note)
+        if queued is not None:
+            note.title        = queued.title
+            note.notebookGuid = queued.notebookGuid
+
+    notebook = GeeknoteGetCachedNotebook(note.notebookGuid)
+    if notebook is None:
+        notebook = GeeknoteGetNotebook(note.notebookGuid)
+    return note, notebook
+
+#
+# Fill the buffer of an opened note (see GeeknoteOpenNote) when Vim reads it.
+# The note's title and content are shown if the note was loaded already, its
+# title and a placeholder otherwise.
+#
+def GeeknoteReadNote(name):
+    tracker = openNotes.get(GeeknoteGetNoteGuid(name))
+    if tracker is None:
+        vim.command('echoerr "Geeknote: note is not opened"')
+        return
+
+    buffer = vim.current.buffer
+    buffer.options['buftype']  = 'acwrite'
+    buffer.options['swapfile'] = False
+
+    tracker.buffer = buffer
+    if tracker.loading:
+        buffer[:] = [tracker.note.title, '', NoteTextLoading]
+
+        # Do not let the user edit the placeholder.
+        buffer.options['modifiable'] = False
+    else:
+        GeeknoteSetNoteLines(tracker, tracker.note)
+    buffer.options['modified'] = False
+
+#
+# Replace the lines of the note's buffer with the title and content of the
+# given note. Returns the text of the content.
+#
+def GeeknoteSetNoteLines(tracker, note):
+    from geeknote.out import tools
+
+    content = GeeknoteGetNoteText(note)
+    content = tools.stdoutEncode(content)
+
+    lines = [note.title, '']
+    isNoteEmpty = not content.strip()
+    if isNoteEmpty is False:
+        lines += content.splitlines()
+    else:
+        lines.append("<add content here>")
+
+    buffer = tracker.buffer
+    buffer.options['modifiable'] = True
+    buffer[:] = lines
+
+    # Later saves compare the buffer with what it shows now.
+    tracker.textHash = hashlib.md5(GeeknoteGetBufferNote(lines)[1]).digest()
+    return content
+
+# Replace the placeholder shown while a note is loading with its content.
+def GeeknoteShowNoteContent(tracker, note, notebook):
+    if openNotes.get(note.guid) is not tracker:
+        return
+
+    content     = GeeknoteSetNoteLines(tracker, note)
+    isNoteEmpty = not content.strip()
+
+    buffer = tracker.buffer
+    buffer.options['modified'] = False
+
+    tracker.note    = note
+    tracker.loading = False
+
+    GeeknoteIndexNoteText(note, content)
+
+    buffer.vars['GeeknoteTitle'] = note.title
+    if notebook is not None:
+        buffer.vars['GeeknoteNotebook'] = notebook.name
+
+    # Position the cursor at a convenient location if opening an empty note
+    if isNoteEmpty and vim.current.buffer.number == buffer.number:
+        vim.current.window.cursor = (3, 0)
+
+#
+# Convert the content of the note to text, unless the same content was
+# converted to the same format before. The content is hashed rather than
+# trusting note.contentHash: a note that was saved but not uploaded yet has
+# new content but still the hash of the content it was based on.
+#
+def GeeknoteGetNoteText(note):
+    format      = getFormat()
+    contentHash = hashlib.md5(note.content).digest()
+
+    text = textCache.get(contentHash, format)
+    stats.countLookup('textCache', text is not None)
+    if text is None:
+        text = ENMLtoText(note.content, format)
+        textCache.put(contentHash, format, text)
+    return text
+
+def GeeknoteHandleNoteLoadFailure(tracker, e):
+    # Wiping the buffer closes the note (see GeeknoteCloseNote).
+    buffer = tracker.buffer
+    if openNotes.get(tracker.note.guid) is tracker:
+        vim.command('bwipeout! {}'.format(buffer.number))
+    vim.command('echoerr "Failed to load note ({})"'.format(
+        str(e).replace('"', "'")))
 
 def GeeknoteGetFirstUsableWindow():
    wnum = 1
@@ -214,14 +414,16 @@ def GeeknoteIsWindowUsable(wnum):
         return False
 
     bnum    = vim.windows[wnum-1].buffer.number
+    name    = getBufferName(bnum)
+    isNote  = GeeknoteGetNoteGuid(name) in openNotes
     buftype = getBufferVariable(bnum, 'buftype')
     preview = getWindowVariable(wnum, 'previewwindow')
 
     #
-    # If the window's buffer has a special type or is the preview window, it is
-    # not usable.
+    # If the window's buffer has a special type (other than that of notes) or
+    # is the preview window, it is not usable.
     #
-    if (buftype != '') or (preview is True):
+    if (buftype != '' and not isNote) or (preview is True):
         return False
 
     # If the user has the 'hidden' option set, the window is usable.
@@ -232,8 +434,7 @@ def GeeknoteIsWindowUsable(wnum):
     # If the window's buffer belongs to an unmodified note, the window is
     # usable.
     #
-    name = getBufferName(bnum)
-    if name in openNotes:
+    if isNote:
         isModified = getBufferVariable(bnum, 'modified')
         if isModified is False:
             return True
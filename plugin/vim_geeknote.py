@@ -1,3 +1,8 @@
+import time
+
+# Time how long loading the modules takes (see startupPhase()).
+loadStart = time.time()
+
 import vim
 import re
 
@@ -6,8 +11,12 @@ from view     import *
 from utils    import *
 from enml     import *
 
-import evernote.edam.type.ttypes  as Types
-import evernote.edam.error.ttypes as Errors
+import evernote.edam.type.ttypes as Types
+
+import stats
+import worker
+
+startupTimes.append(('modules', time.time() - loadStart))
 
 #
 # +----------+---------------------------+
@@ -27,17 +36,34 @@ import evernote.edam.error.ttypes as Errors
 
 #======================== Globals ============================================#
 
-explorer = Explorer()
+# Created when first needed, see getExplorer().
+explorer = None
+
+#
+# Return the navigation window, creating it first if needed. Commands that do
+# not need it (e.g. :GeeknoteSaveAsNote) leave it alone so that using them
+# does not load every notebook.
+#
+def getExplorer():
+    global explorer
+
+    if explorer is None:
+        with startupPhase('explorer'):
+            explorer = Explorer()
+
+        # Upload the notes that were saved but not uploaded before Vim was
+        # closed.
+        saveQueue.process()
+    return explorer
 
 #======================== Geeknote Functions  ================================#
 
 def GeeknoteActivateNode():
-    explorer.activateNode(vim.current.line)
+    getExplorer().activateNode(vim.current.line)
 
-def GeeknoteCommitStart():
+def GeeknoteCommitChanges():
+    explorer = getExplorer()
     explorer.commitChanges()
-
-def GeeknoteCommitComplete():
     explorer.render()
 
 def GeeknoteCreateNote(title):
@@ -46,7 +72,10 @@ def GeeknoteCreateNote(title):
     # notebook selected in the explorer window (if one is selected). Otherwise,
     # place it into the default notebook.
     #
-    notebook = explorer.getSelectedNotebook()
+    notebook = None
+    if explorer is not None:
+        notebook = explorer.getSelectedNotebook()
+
     if notebook is None:
         notebook = GeeknoteGetDefaultNotebook()
 
@@ -64,11 +93,17 @@ def GeeknoteCreateNote(title):
     note.created      = None
     note.notebookGuid = notebook.guid
 
-    note = GeeknoteCreateNewNote(note)
+    # While offline, the note is created once back online.
+    if GeeknoteIsOffline():
+        note.content = textToENML('')
+        note = saveQueue.create(note)
+    else:
+        note = GeeknoteCreateNewNote(note)
     GeeknoteOpenNote(note)
 
     # Add the note to the navigation window.
-    explorer.addNote(note)
+    if explorer is not None:
+        explorer.addNote(note)
 
 def GeeknoteCreateNotebook(name):
     notebook = Types.Notebook()
@@ -77,8 +112,9 @@ def GeeknoteCreateNotebook(name):
         notebook = GeeknoteCreateNewNotebook(notebook)
     except:
         vim.command('echoerr "Failed to create notebook."')
+        return
 
-    explorer.addNotebook(notebook)
+    getExplorer().addNotebook(notebook)
 
 def GeeknoteHandleNoteSaveFailure(note, e):
     print e
@@ -91,9 +127,27 @@ def GeeknoteHandleNoteSaveFailure(note, e):
     msg += '+------------------- WARNING -------------------+\n'
     vim.command('echoerr "%s"' % msg)
 
-def GeeknoteSaveAsNote():
-    global explorer
+def GeeknoteGoOffline():
+    GeeknoteSetOffline(True)
+    print 'Geeknote: offline, changes are uploaded once back online'
+
+#
+# Replay what was saved while offline and bring the navigation window
+# up-to-date with the server.
+#
+def GeeknoteGoOnline():
+    GeeknoteSetOffline(False)
+    saveQueue.flush()
+    if explorer is not None:
+        explorer.refreshInBackground()
 
+def GeeknotePoll():
+    worker.poll()
+
+def GeeknoteProcessSaves():
+    saveQueue.process()
+
+def GeeknoteSaveAsNote():
     #
     # Figure out what notebook to place the note in. Give preference
     # to the notebook selected in the explorer window (if one is 
@@ -110,24 +164,14 @@ def GeeknoteSaveAsNote():
         vim.command('echoerr "Please select a notebook first."')
         return
 
-    title = ''
-    rows  = len(vim.current.buffer)
-    if rows > 0:
-        title = vim.current.buffer[0].strip()
-    else:
+    lines = vim.current.buffer[:]
+    rows  = len(lines)
+    if rows == 0:
         vim.command('echoerr "Cannot save empty note."')
         return
 
-    content = ''
+    title, content = GeeknoteGetBufferNote(lines)
     if rows > 1:
-        start = 1
-        while start < rows:
-            if vim.current.buffer[start].strip() != '':
-                break
-            start += 1
-        for r in range(start, len(vim.current.buffer)):
-            content += vim.current.buffer[r] + '\n'
-
         note         = Types.Note()
         note.title   = title
         note.content = textToENML(content)
@@ -135,8 +179,11 @@ def GeeknoteSaveAsNote():
         note.notebookGuid = notebook.guid
 
     try:
-        note = GeeknoteCreateNewNote(note)
-        note = GeeknoteLoadNote(note)
+        if GeeknoteIsOffline():
+            note = saveQueue.create(note)
+        else:
+            note = GeeknoteCreateNewNote(note)
+            note = GeeknoteLoadNote(note)
     except Exception as e:
         GeeknoteHandleNoteSaveFailure(note, e)
         return
@@ -144,35 +191,103 @@ def GeeknoteSaveAsNote():
     GeeknoteOpenNote(note)
 
     # Add the note to the navigation window.
-    explorer.addNote(note)
+    if explorer is not None:
+        explorer.addNote(note)
 
-def GeeknoteSaveNote(filename):
-    note    = GeeknoteGetOpenNote(filename)
+def GeeknoteSaveNote(name):
+    note    = GeeknoteGetOpenNote(name)
     changed = GeeknoteCommitChangesToNote(note)
     if changed:
-        try:
-            GeeknoteUpdateNote(note)
-        except Exception as e:
-            GeeknoteHandleNoteSaveFailure(note, e)
+        #
+        # Queue the note for upload in the background (see savequeue.py).
+        # Only upload the content if it changed, renaming the note only
+        # requires its title to be sent.
+        #
+        withContent = GeeknoteNoteContentIsModified(note)
+        saveQueue.add(note, withContent)
+
+def GeeknoteShowSaveQueue():
+    saves = saveQueue.getSaves()
+    if len(saves) == 0:
+        print 'All notes are saved'
+        return
 
-def GeeknoteSearch(args):
-    notes = GeeknoteGetNotes(args)
+    for save in saves:
+        print '{}: {}'.format(save.describe(), save.status)
 
-    explorer.clearSearchResults()
-    explorer.addSearchResults(notes)
-    explorer.render()
+def GeeknoteSearch(args, remote=False):
+    explorer = getExplorer()
+
+    #
+    # Answer from the local search index when possible. Go to the server if
+    # asked to (:GeeknoteSearch!) or if nothing was found locally.
+    #
+    if not remote:
+        notes = GeeknoteSearchLocally(args)
+        if notes:
+            explorer.clearSearchResults()
+            explorer.addSearchResults(notes)
+            explorer.render()
+            return
+
+    explorer.showSearchResults(GeeknoteGetNotes(args))
+
+def GeeknoteCursorMoved():
+    getExplorer().onCursorMoved()
+
+def GeeknoteShowStartupTime():
+    for name, seconds in startupTimes:
+        print '{:<16}{:8.1f} ms'.format(name, seconds * 1000)
+
+#
+# Show what was measured since Vim started (or since the statistics were last
+# reset): timings of requests and conversions, then cache lookups.
+#
+def GeeknoteShowStats(reset=False):
+    if reset:
+        stats.resetStats()
+        return
+
+    timed  = [s for s in stats.getStats() if s.count > 0]
+    cached = [s for s in stats.getStats() if s.hits + s.misses > 0]
+
+    print '{:<28}{:>7}{:>7}{:>10}{:>10}{:>11}{:>10}{:>10}'.format(
+        'operation', 'calls', 'errors', 'p50 ms', 'p95 ms', 'total ms',
+        'sent KB', 'recv KB')
+    for stat in timed:
+        print '{:<28}{:>7}{:>7}{:>10.1f}{:>10.1f}{:>11.1f}{:>10.1f}{:>10.1f}' \
+            .format(stat.name, stat.count, stat.errors,
+                    stat.percentile(0.50) * 1000,
+                    stat.percentile(0.95) * 1000,
+                    stat.seconds * 1000,
+                    stat.sent / 1024.0,
+                    stat.received / 1024.0)
+
+    if cached:
+        print ''
+        print '{:<28}{:>7}{:>7}{:>10}'.format(
+            'cache', 'hits', 'misses', 'hit %')
+        for stat in cached:
+            print '{:<28}{:>7}{:>7}{:>10.1f}'.format(
+                stat.name, stat.hits, stat.misses,
+                100.0 * stat.hits / (stat.hits + stat.misses))
 
 def GeeknoteSync():
+    explorer = getExplorer()
     explorer.commitChanges()
-    explorer.refresh()    
+    if GeeknoteIsOffline():
+        explorer.render()
+        vim.command('echoerr "Cannot sync while offline."')
+        return
+
+    explorer.sync()
     explorer.render()
 
 def GeeknoteTerminate():
     GeeknoteCloseAllNotes()
 
 def GeeknoteToggle():
-    global explorer
-
+    explorer = getExplorer()
     if explorer.isHidden():
         explorer.show()
     else:
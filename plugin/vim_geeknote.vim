@@ -28,8 +28,8 @@ endfunction
 function! Vim_GeeknoteCloseNote(arg1)
 python << endOfPython
 from vim_geeknote import GeeknoteCloseNote
-filename = vim.eval("a:arg1")
-GeeknoteCloseNote(filename)
+name = vim.eval("a:arg1")
+GeeknoteCloseNote(name)
 endOfPython
 endfunction
 
@@ -56,27 +56,28 @@ GeeknoteSaveAsNote()
 endOfPython
 endfunction
 
-function! Vim_GeeknoteSearch(arg1)
+function! Vim_GeeknoteSearch(arg1, arg2)
 python << endOfPython
 from vim_geeknote import GeeknoteSearch
-args = vim.eval("a:arg1")
-GeeknoteSearch(args)
+args   = vim.eval("a:arg1")
+remote = int(vim.eval("a:arg2")) != 0
+GeeknoteSearch(args, remote)
 endOfPython
 endfunction
 
-function! Vim_GeeknotePrepareToSaveNote(arg1)
+function! Vim_GeeknoteReadNote(arg1)
 python << endOfPython
-from vim_geeknote import GeeknotePrepareToSaveNote
-filename = vim.eval("a:arg1")
-GeeknotePrepareToSaveNote(filename)
+from vim_geeknote import GeeknoteReadNote
+name = vim.eval("a:arg1")
+GeeknoteReadNote(name)
 endOfPython
 endfunction
 
 function! Vim_GeeknoteSaveNote(arg1)
 python << endOfPython
 from vim_geeknote import GeeknoteSaveNote
-filename = vim.eval("a:arg1")
-GeeknoteSaveNote(filename)
+name = vim.eval("a:arg1")
+GeeknoteSaveNote(name)
 endOfPython
 endfunction
 
@@ -87,25 +88,80 @@ GeeknoteSync()
 endOfPython
 endfunction
 
-function! Vim_GeeknoteCommitStart()
+function! Vim_GeeknoteCommitChanges()
+python << endOfPython
+from vim_geeknote import GeeknoteCommitChanges
+GeeknoteCommitChanges()
+endOfPython
+endfunction
+
+function! Vim_GeeknoteOffline()
+python << endOfPython
+from vim_geeknote import GeeknoteGoOffline
+GeeknoteGoOffline()
+endOfPython
+endfunction
+
+function! Vim_GeeknoteOnline()
+python << endOfPython
+from vim_geeknote import GeeknoteGoOnline
+GeeknoteGoOnline()
+endOfPython
+endfunction
+
+function! Vim_GeeknotePoll(timer)
+python << endOfPython
+from vim_geeknote import GeeknotePoll
+GeeknotePoll()
+endOfPython
+endfunction
+
+function! Vim_GeeknoteProcessSaves(timer)
+python << endOfPython
+from vim_geeknote import GeeknoteProcessSaves
+GeeknoteProcessSaves()
+endOfPython
+endfunction
+
+function! Vim_GeeknoteSaveStatus()
+python << endOfPython
+from vim_geeknote import GeeknoteShowSaveQueue
+GeeknoteShowSaveQueue()
+endOfPython
+endfunction
+
+function! Vim_GeeknoteStats(arg1)
+python << endOfPython
+from vim_geeknote import GeeknoteShowStats
+reset = int(vim.eval("a:arg1")) != 0
+GeeknoteShowStats(reset)
+endOfPython
+endfunction
+
+function! Vim_GeeknoteStartupTime()
 python << endOfPython
-from vim_geeknote import GeeknoteCommitStart
-GeeknoteCommitStart()
+from vim_geeknote import GeeknoteShowStartupTime
+GeeknoteShowStartupTime()
 endOfPython
 endfunction
 
-function! Vim_GeeknoteCommitComplete()
+function! Vim_GeeknoteCursorMoved()
 python << endOfPython
-from vim_geeknote import GeeknoteCommitComplete
-GeeknoteCommitComplete()
+from vim_geeknote import GeeknoteCursorMoved
+GeeknoteCursorMoved()
 endOfPython
 endfunction
 
 " ---------------------- User Commands ----------------------------------------
 
-command!          Geeknote               call Vim_GeeknoteToggle()
-command! -nargs=1 GeeknoteCreateNotebook call Vim_GeeknoteCreateNotebook(<f-args>)
-command! -nargs=1 GeeknoteCreateNote     call Vim_GeeknoteCreateNote(<f-args>)
-command!          GeeknoteSaveAsNote     call Vim_GeeknoteSaveAsNote()
-command! -nargs=* GeeknoteSearch         call Vim_GeeknoteSearch(<q-args>)
-command!          GeeknoteSync           call Vim_GeeknoteSync()
+command!                Geeknote               call Vim_GeeknoteToggle()
+command! -nargs=1       GeeknoteCreateNotebook call Vim_GeeknoteCreateNotebook(<f-args>)
+command! -nargs=1       GeeknoteCreateNote     call Vim_GeeknoteCreateNote(<f-args>)
+command!                GeeknoteOffline        call Vim_GeeknoteOffline()
+command!                GeeknoteOnline         call Vim_GeeknoteOnline()
+command!                GeeknoteSaveAsNote     call Vim_GeeknoteSaveAsNote()
+command! -bang -nargs=* GeeknoteSearch         call Vim_GeeknoteSearch(<q-args>, <bang>0)
+command!                GeeknoteSaveStatus     call Vim_GeeknoteSaveStatus()
+command!                GeeknoteStartupTime    call Vim_GeeknoteStartupTime()
+command! -bang          GeeknoteStats          call Vim_GeeknoteStats(<bang>0)
+command!                GeeknoteSync           call Vim_GeeknoteSync()
@@ -0,0 +1,216 @@
+import vim
+import sys
+import threading
+import Queue
+
+#
+# Background work. Network calls are run by a pool of worker threads so that
+# Vim is never blocked waiting on the server. Submitting work returns a Future
+# whose callbacks are invoked on Vim's own thread, since Vim's interfaces may
+# not be used from any other thread. Finished work is picked up by a timer
+# that polls for it (see poll()).
+#
+# Vim versions without timers cannot deliver results later, so work is run
+# synchronously instead (as is the case when g:GeeknoteAsync is set to 0).
+#
+
+#======================== Future =============================================#
+
+class Future(object):
+    def __init__(self):
+        self.finished  = threading.Event()
+        self.delivered = False
+        self.result    = None
+        self.error     = None
+        self.callbacks = []
+
+    #
+    # Register functions to be called (on Vim's thread) with the result or, if
+    # the work failed, with the exception that was raised.
+    #
+    def then(self, callback=None, errback=None):
+        if self.delivered:
+            self.invoke(callback, errback)
+        else:
+            self.callbacks.append((callback, errback))
+        return self
+
+    def deliver(self):
+        self.delivered = True
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback, errback in callbacks:
+            self.invoke(callback, errback)
+
+    def failed(self):
+        return self.error is not None
+
+    #
+    # Record the outcome of the work. If a queue is given, the future is put
+    # on it before anyone waiting on the future is woken up.
+    #
+    def finish(self, result=None, error=None, queue=None):
+        self.result = result
+        self.error  = error
+        if queue is not None:
+            queue.put(self)
+        self.finished.set()
+
+    def invoke(self, callback, errback):
+        try:
+            if self.error is None:
+                if callback is not None:
+                    callback(self.result)
+            elif errback is not None:
+                errback(self.error)
+        except Exception as e:
+            sys.stderr.write('vim-geeknote: {}\n'.format(e))
+
+    def isDone(self):
+        return self.finished.is_set()
+
+    #
+    # Block until the work is done and return its result. Pending callbacks
+    # of all finished work are delivered before returning.
+    #
+    def wait(self):
+        self.finished.wait()
+        poll()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+#======================== WorkerPool =========================================#
+
+#
+# A pool of up to 'size' threads. A 'threaded' pool uses its threads even when
+# results cannot be delivered later (see isAvailable()). It is meant for work
+# that the caller waits on (see Future.wait() and gather()) but that should
+# still run in parallel.
+#
+class WorkerPool(object):
+    def __init__(self, size, threaded=False):
+        self.size     = max(size, 1)
+        self.threaded = threaded
+        self.jobs     = Queue.Queue()
+        self.threads  = []
+        self.idle     = 0
+        self.lock     = threading.Lock()
+
+    def submit(self, func, *args):
+        global pending
+
+        future = Future()
+        available = isAvailable()
+        if not available and not self.threaded:
+            runJob(future, func, args)
+            future.deliver()
+            return future
+
+        pending += 1
+        self.jobs.put((future, func, args))
+
+        with self.lock:
+            if self.idle == 0 and len(self.threads) < self.size:
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+        if available:
+            startPolling()
+        return future
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            future, func, args = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+
+            runJob(future, func, args, completed)
+
+#
+# Return a Future that is delivered once all of the given futures have been
+# delivered. Its result is the list of their results (None for failures).
+#
+def gather(futures):
+    combined  = Future()
+    remaining = [len(futures)]
+
+    def onDelivered(value):
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            combined.finish([f.result for f in futures])
+            combined.deliver()
+
+    if not futures:
+        combined.finish([])
+        combined.deliver()
+
+    for future in futures:
+        future.then(onDelivered, onDelivered)
+    return combined
+
+def runJob(future, func, args, queue=None):
+    try:
+        result = func(*args)
+    except Exception as e:
+        future.finish(error=e, queue=queue)
+    else:
+        future.finish(result=result, queue=queue)
+
+#======================== Polling ============================================#
+
+# Futures that have finished but whose callbacks have not been invoked yet.
+completed = Queue.Queue()
+
+# Number of submitted futures whose callbacks have not been invoked yet.
+pending = 0
+
+# Identifier of the Vim timer that is polling for finished work (if any).
+pollTimer = None
+
+def isAvailable():
+    if int(vim.eval('exists("g:GeeknoteAsync")')):
+        if not int(vim.eval('g:GeeknoteAsync')):
+            return False
+    return int(vim.eval('has("timers")')) == 1
+
+def startPolling():
+    global pollTimer
+
+    if pollTimer is None:
+        pollTimer = int(vim.eval(
+            "timer_start(50, 'Vim_GeeknotePoll', {'repeat': -1})"))
+
+# Invoke the callbacks of all finished work. Called on Vim's thread.
+def poll():
+    global pending
+    global pollTimer
+
+    while True:
+        try:
+            future = completed.get_nowait()
+        except Queue.Empty:
+            break
+
+        pending = max(pending - 1, 0)
+        future.deliver()
+
+    if pending == 0 and pollTimer is not None:
+        vim.command('call timer_stop({})'.format(pollTimer))
+        pollTimer = None
+
+#======================== Globals ============================================#
+
+def getPoolSize():
+    if int(vim.eval('exists("g:GeeknoteWorkerThreads")')):
+        return int(vim.eval('g:GeeknoteWorkerThreads'))
+    return 4
+
+pool = WorkerPool(getPoolSize())
+
+def submit(func, *args):
+    return pool.submit(func, *args)
@@ -6,11 +6,11 @@ import re
 
 from powerline.bindings.vim import buffer_name
 
-GEEKNOTE_RE = re.compile('__Geeknote__')
+GEEKNOTE_RE = re.compile('geeknote://')
 
 def geeknote(matcher_info):
 	name = buffer_name(matcher_info)
-	return name and GEEKNOTE_RE.match(os.path.basename(name))
+	return name and GEEKNOTE_RE.match(name)
 
 GEEKNOTE_EXPLORER_RE = re.compile('__GeeknoteExplorer__')
 